@@ -0,0 +1,135 @@
+"""
+Бенчмарк поиска артиста: полный перебор rapidfuzz против отбора кандидатов по триграммам.
+
+Для библиотек из 1k, 10k и 100k синтетических артистов меряет задержку (p50/p99)
+и полноту: доля запросов, где отбор кандидатов нашёл того же артиста, что и полный перебор.
+
+Запуск:
+    python bench_artist_match.py [--sizes 1000 10000 100000] [--queries 300] [--json results.json]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import time
+
+from synthetic_library import SYLLABLES, make_artists
+
+PLUGIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugin_music_search_v2_7.py")
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location("music_search_bench", PLUGIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_queries(plugin, artists: list, count: int, rng: random.Random) -> list:
+    """Половина — точная фонетика, треть — с опечаткой, остальное — несуществующие имена."""
+    queries = []
+    for i in range(count):
+        kind = i % 6
+        if kind < 3:
+            queries.append(plugin.eng_to_ru_phonetic(rng.choice(artists)))
+        elif kind < 5:
+            text = list(plugin.eng_to_ru_phonetic(rng.choice(artists)))
+            pos = rng.randrange(len(text))
+            text[pos] = rng.choice("абвгдеклмнопрст")
+            queries.append("".join(text))
+        else:
+            queries.append(plugin.eng_to_ru_phonetic(" ".join(rng.sample(SYLLABLES, 4))))
+    return queries
+
+
+def full_scan(plugin, index: dict, query: str):
+    """Эталон: точное совпадение фонетики, иначе rapidfuzz по всем артистам — как в плагине без отбора."""
+    from rapidfuzz import process, fuzz
+    pos = plugin._get_artist_exact(index).get(query.strip())
+    if pos is not None:
+        return index["artists"][pos], 100
+    result = process.extractOne(query, index["phonetic"], scorer=fuzz.partial_ratio)
+    if result and result[1] >= plugin.config["min_similarity"]:
+        return index["artists"][result[2]], result[1]
+    return None, None
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(sizes: list, query_count: int, seed: int) -> list:
+    from rapidfuzz import fuzz
+    plugin = load_plugin()
+    results = []
+    for size in sizes:
+        rng = random.Random(seed + size)
+        artists = make_artists(size, rng)
+        index = plugin._build_artist_index(artists)
+        plugin._cache["artist_index"] = index
+        plugin._cache["pure_artists"] = set(artists)
+
+        started = time.perf_counter()
+        plugin._get_artist_exact(index)
+        plugin._get_artist_grams(index)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        queries = make_queries(plugin, artists, query_count, rng)
+        full_times, fast_times = [], []
+        phonetic = dict(zip(index["artists"], index["phonetic"]))
+        expected_matches = agreed = same_score = 0
+        for query in queries:
+            t0 = time.perf_counter()
+            expected, expected_score = full_scan(plugin, index, query)
+            t1 = time.perf_counter()
+            found = plugin._match_artist(query)
+            t2 = time.perf_counter()
+            full_times.append((t1 - t0) * 1000)
+            fast_times.append((t2 - t1) * 1000)
+            if expected is not None:
+                expected_matches += 1
+                agreed += found == expected
+                # Другой артист с той же оценкой — равноценный ответ (ничья при переборе)
+                same_score += found is not None and fuzz.partial_ratio(query, phonetic[found]) >= expected_score
+
+        results.append({
+            "artists": size,
+            "queries": query_count,
+            "index_build_ms": round(build_ms, 1),
+            "full_p50_ms": round(statistics.median(full_times), 3),
+            "full_p99_ms": round(percentile(full_times, 0.99), 3),
+            "prefilter_p50_ms": round(statistics.median(fast_times), 3),
+            "prefilter_p99_ms": round(percentile(fast_times, 0.99), 3),
+            "matches": expected_matches,
+            "recall_same_artist": round(agreed / expected_matches, 4) if expected_matches else None,
+            "recall_same_score": round(same_score / expected_matches, 4) if expected_matches else None,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--json", help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.seed)
+    print(f"{'артистов':>9} {'полный p50/p99, мс':>20} {'отбор p50/p99, мс':>19}"
+          f" {'тот же артист':>14} {'та же оценка':>13} {'индекс, мс':>11}")
+    for r in results:
+        print(f"{r['artists']:>9} {r['full_p50_ms']:>9.2f} / {r['full_p99_ms']:<8.2f}"
+              f" {r['prefilter_p50_ms']:>8.2f} / {r['prefilter_p99_ms']:<8.2f}"
+              f" {r['recall_same_artist']!s:>14} {r['recall_same_score']!s:>13} {r['index_build_ms']:>11.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Бенчмарк плагина music_search на синтетической библиотеке.
+
+Для каждого размера библиотеки (по умолчанию 1k и 10k файлов; поддерживается до 500k)
+в отдельном процессе измеряет:
+- полное сканирование (холодное, без манифеста) и повторное — время и файлов/с;
+- сохранение и загрузку кэша для JSON и SQLite;
+- скорость транслитерации eng_to_ru_phonetic без кэша;
+- память под треки: прежний список словарей против компактной _TrackTable;
+- задержку команд «найди артиста», «включи радио», «включи песню» (p50/p99)
+  через поддельный интерфейс VA, без обращения к Home Assistant;
+- время импорта плагина (кэш и библиотеки грузятся в фоне) и пиковый RSS процесса.
+
+Каждый прогон дописывается строкой JSON в файл результатов, чтобы сравнивать версии.
+
+Запуск:
+    python bench_music_search.py --files 1000 10000 100000 --out bench_results.jsonl
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from synthetic_library import generate_library
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_PATH = os.path.join(BENCH_DIR, "..", "plugin_music_search_v2_7.py")
+
+
+class FakeVA:
+    """Интерфейс VA, который только запоминает сказанное."""
+
+    def __init__(self):
+        self.said = []
+
+    def say(self, text: str):
+        self.said.append(text)
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location("music_search_bench", PLUGIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mb() -> float:
+    # На Linux ru_maxrss в килобайтах, на macOS — в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def latency_stats(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def tracks_memory(plugin, tracks: list) -> dict:
+    """
+    Сколько памяти занимают треки после загрузки кэша: список словарей (как из json.load)
+    и та же библиотека в _TrackTable. Строки у обоих вариантов свои, кэш транслитерации не считается.
+    """
+    payload = json.dumps(tracks, ensure_ascii=False)
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        data = json.loads(payload)
+        dict_bytes = tracemalloc.get_traced_memory()[0] - base
+        table = plugin._TrackTable.from_dicts(data)
+        del data
+        plugin._transliterate.cache_clear()
+        table_bytes = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    return {
+        "dicts_mb": round(dict_bytes / (1024 * 1024), 2),
+        "table_mb": round(table_bytes / (1024 * 1024), 2),
+        "ratio": round(dict_bytes / table_bytes, 2) if table_bytes else None,
+        "overrides": len(table._ru_overrides),
+    }
+
+
+def make_queries(plugin, tracks: list, count: int, rng: random.Random) -> dict:
+    artists = sorted({t["artist"] for t in tracks if plugin._is_pure_artist(t["artist"])})
+    artist_queries = []
+    for i in range(count):
+        spoken = plugin.eng_to_ru_phonetic(rng.choice(artists))
+        if i % 3 == 2:
+            # Опечатка распознавания речи
+            pos = rng.randrange(len(spoken))
+            spoken = spoken[:pos] + rng.choice("абвгдеклмнопрст") + spoken[pos + 1:]
+        artist_queries.append(spoken)
+    track_queries = [
+        plugin.eng_to_ru_phonetic(t["title"] if i % 2 else f"{t['artist']} {t['title']}")
+        for i, t in enumerate(rng.sample(tracks, min(count, len(tracks))))
+    ]
+    return {"artist": artist_queries, "track": track_queries}
+
+
+def measure_lookups(plugin, queries: dict) -> dict:
+    va = FakeVA()
+    handlers = {
+        "find_artist": (plugin.handle_find_artist, queries["artist"]),
+        "radio_artist": (plugin.handle_radio_artist, queries["artist"]),
+        "play_track": (plugin.handle_play_track, queries["track"]),
+    }
+    result = {}
+    for name, (handler, phrases) in handlers.items():
+        # Первый вызов отдельно: в нём строятся ленивые индексы
+        first = timed(handler, va, phrases[0])
+        samples = [timed(handler, va, phrase) for phrase in phrases[1:]]
+        stats = latency_stats(samples)
+        stats["first_call_ms"] = round(first * 1000, 3)
+        result[name] = stats
+    return result
+
+
+def run_single(files: int, library_root: str, queries: int, pool: str, workers: int, seed: int) -> dict:
+    """Один прогон в текущем процессе (вызывается в дочернем процессе)."""
+    library = os.path.join(library_root, f"synthetic_{files}")
+    started = time.perf_counter()
+    generate_library(library, files, seed)
+    generate_s = time.perf_counter() - started
+
+    workdir = tempfile.mkdtemp(prefix="music_bench_")
+    os.chdir(workdir)
+    started = time.perf_counter()
+    plugin = load_plugin()
+    import_s = time.perf_counter() - started
+    # Фоновая загрузка и прогрев не должны пересекаться с замерами
+    for thread in threading.enumerate():
+        if thread.name == "music_load":
+            thread.join()
+    plugin._play_via_ha = lambda *args, **kwargs: None
+    plugin.config.update({
+        "music_folder": library,
+        "use_intro_phrases": False,
+        "scan_pool": pool,
+        "scan_workers": workers,
+        "cache_backend": "json",
+    })
+    va = FakeVA()
+    report = {"files": files, "generate_s": round(generate_s, 2), "import_ms": round(import_s * 1000, 1),
+              "rss_after_import_mb": peak_rss_mb()}
+
+    # --- Сканирование ---
+    cold = timed(plugin._scan_worker, va)
+    cold_bytes = plugin._progress_snapshot().get("bytes_read")
+    warm = timed(plugin._scan_worker, va)
+    track_count = len(plugin._cache["tracks"])
+    report["scan"] = {
+        "tracks": track_count,
+        "artists": len(plugin._cache["pure_artists"]),
+        "cold_s": round(cold, 3),
+        "cold_files_per_sec": round(track_count / cold, 1) if cold else None,
+        "warm_s": round(warm, 3),
+        "warm_files_per_sec": round(track_count / warm, 1) if warm else None,
+        "cold_bytes_read": cold_bytes,
+    }
+    report["rss_after_scan_mb"] = peak_rss_mb()
+    tracks = list(plugin._cache["tracks"])
+
+    # --- Транслитерация ---
+    names = [t["search_name"] for t in tracks]
+    plugin._transliterate.cache_clear()
+    phonetic_s = timed(lambda: [plugin.eng_to_ru_phonetic(n) for n in names])
+    report["phonetic_per_sec"] = round(len(names) / phonetic_s, 1) if phonetic_s else None
+    report["tracks_memory"] = tracks_memory(plugin, tracks)
+
+    # --- Кэш: JSON ---
+    report["cache"] = {
+        "json_save_s": round(timed(plugin._save_cache), 3),
+        "json_load_s": round(timed(plugin._load_cache), 3),
+        "json_file_mb": round(os.path.getsize(plugin._cache_file) / (1024 * 1024), 2),
+    }
+    rng = random.Random(seed)
+    query_set = make_queries(plugin, tracks, queries, rng)
+    report["lookup_json"] = measure_lookups(plugin, query_set)
+    report["rss_after_json_mb"] = peak_rss_mb()
+
+    # --- Кэш: SQLite ---
+    manifest = plugin._load_manifest()
+    plugin.config["cache_backend"] = "sqlite"
+    migrate_s = timed(plugin._load_cache)  # однократный перенос манифеста JSON → SQLite
+    pure_artists, table = plugin._derive_library(manifest)
+    artist_index = plugin._build_artist_index(pure_artists)
+    report["cache"].update({
+        "sqlite_migrate_s": round(migrate_s, 3),
+        "sqlite_save_s": round(timed(plugin._db_save, manifest, table, artist_index), 3),
+        "sqlite_load_s": round(timed(plugin._load_cache), 3),
+        "sqlite_first_index_s": round(timed(plugin._get_artist_index), 3),
+        "sqlite_file_mb": round(os.path.getsize(plugin._db_file) / (1024 * 1024), 2),
+    })
+    report["lookup_sqlite"] = measure_lookups(plugin, query_set)
+    report["rss_peak_mb"] = peak_rss_mb()
+
+    os.chdir(BENCH_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def run_child(args) -> dict:
+    """Запускает прогон в отдельном процессе, чтобы пиковый RSS не смешивался между размерами."""
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--files", str(args.files_one), "--library-root", args.library_root,
+        "--queries", str(args.queries), "--pool", args.pool,
+        "--workers", str(args.workers), "--seed", str(args.seed),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=BENCH_DIR)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip() or f"прогон для {args.files_one} файлов упал")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=BENCH_DIR, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--library-root", default=os.path.join(tempfile.gettempdir(), "music_search_bench"))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench_results.jsonl", help="файл результатов (JSON Lines, дописывается)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        report = run_single(args.files[0], args.library_root, args.queries, args.pool, args.workers, args.seed)
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    plugin_version = load_plugin().version
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "plugin_version": plugin_version,
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pool": args.pool,
+        "workers": args.workers,
+    }
+    for files in args.files:
+        args.files_one = files
+        report = run_child(args)
+        record = dict(meta, **report)
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        scan = report["scan"]
+        print(f"{files:>7} файлов: скан {scan['cold_s']} с ({scan['cold_files_per_sec']} ф/с), "
+              f"повторный {scan['warm_s']} с, "
+              f"JSON загрузка {report['cache']['json_load_s']} с, "
+              f"SQLite загрузка {report['cache']['sqlite_load_s']} с, "
+              f"найди артиста p50/p99 {report['lookup_json']['find_artist']['p50_ms']}/"
+              f"{report['lookup_json']['find_artist']['p99_ms']} мс, "
+              f"треки в памяти {report['tracks_memory']['dicts_mb']} → {report['tracks_memory']['table_mb']} МБ, "
+              f"RSS {report['rss_peak_mb']} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Генератор синтетической музыкальной библиотеки для бенчмарков.
+
+Создаёт дерево Артист/Альбом/NN - Название.ext из минимальных, но корректных
+MP3 (ID3v2.4), FLAC (Vorbis comment) и OGG Vorbis файлов с тегами artist/title.
+Аудио в файлах нет — только заголовки, которые читают mutagen и быстрый путь плагина.
+
+Запуск:
+    python synthetic_library.py /tmp/music_1k --files 1000
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+
+ONSETS = ["", "b", "d", "f", "g", "k", "l", "m", "n", "p", "r", "s", "t", "v", "z",
+          "ch", "sh", "th", "ph", "kh", "br", "st", "tr", "gl", "dr", "kr"]
+VOWELS = ["a", "e", "i", "o", "u", "y", "ee", "oo", "ea", "ou"]
+CODAS = ["", "", "", "n", "r", "l", "s", "x", "m", "k", "nd", "st"]
+SYLLABLES = [o + v + c for o in ONSETS for v in VOWELS for c in CODAS]
+
+# Доля форматов и «нечистых» артистов (фиты, дуэты) — примерно как в реальных коллекциях
+FORMAT_WEIGHTS = {".mp3": 60, ".flac": 25, ".ogg": 15}
+COLLAB_JOINERS = [" feat. ", " ft. ", " & ", " x "]
+TRACKS_PER_ALBUM = (8, 14)
+ALBUMS_PER_ARTIST = (1, 4)
+
+MARKER_FILE = ".synthetic_library.json"
+
+
+def make_name(rng: random.Random, words=(1, 3)) -> str:
+    return " ".join(
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))).capitalize()
+        for _ in range(rng.randint(*words))
+    )
+
+
+def make_artists(count: int, rng: random.Random) -> list:
+    names = set()
+    while len(names) < count:
+        names.add(make_name(rng))
+    return sorted(names)
+
+
+# === Заглушки форматов ===
+_MPEG_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _syncsafe(value: int) -> bytes:
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def mp3_bytes(artist: str, title: str) -> bytes:
+    frames = b""
+    for frame_id, text in ((b"TPE1", artist), (b"TIT2", title)):
+        body = b"\x03" + text.encode("utf-8")
+        frames += frame_id + _syncsafe(len(body)) + b"\x00\x00" + body
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frames)) + frames + _MPEG_FRAME * 2
+
+
+def _vorbis_comments(artist: str, title: str) -> bytes:
+    vendor = b"synthetic"
+    comments = [f"ARTIST={artist}".encode("utf-8"), f"TITLE={title}".encode("utf-8")]
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for comment in comments:
+        data += struct.pack("<I", len(comment)) + comment
+    return data
+
+
+def flac_bytes(artist: str, title: str) -> bytes:
+    # STREAMINFO: блоки 4096, 44.1 кГц, 2 канала, 16 бит, длина 0
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6 + bytes([0x0A, 0xC4, 0x42, 0xF0]) + b"\x00" * 20
+    comments = _vorbis_comments(artist, title)
+    return (b"fLaC"
+            + bytes([0x00]) + len(streaminfo).to_bytes(3, "big") + streaminfo
+            + bytes([0x84]) + len(comments).to_bytes(3, "big") + comments
+            + b"\xff\xf8" + b"\x00" * 14)
+
+
+def _ogg_crc_table() -> list:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF if crc & 0x80000000 else (crc << 1) & 0xFFFFFFFF
+        table.append(crc)
+    return table
+
+
+_OGG_CRC = _ogg_crc_table()
+
+
+def _ogg_page(data: bytes, header_type: int, granule: int, sequence: int) -> bytes:
+    segments = [255] * (len(data) // 255) + [len(data) % 255]
+    header = (b"OggS\x00" + bytes([header_type]) + struct.pack("<qII", granule, 1, sequence)
+              + b"\x00\x00\x00\x00" + bytes([len(segments)]) + bytes(segments))
+    page = bytearray(header + data)
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC[((crc >> 24) & 0xFF) ^ byte]
+    page[22:26] = struct.pack("<I", crc)
+    return bytes(page)
+
+
+def ogg_bytes(artist: str, title: str) -> bytes:
+    ident = (b"\x01vorbis" + struct.pack("<IBI", 0, 2, 44100) + struct.pack("<iii", 0, 128000, 0)
+             + bytes([0xB8, 0x01]))
+    comment = b"\x03vorbis" + _vorbis_comments(artist, title) + b"\x01"
+    setup = b"\x05vorbis" + b"\x00" * 16
+    return (_ogg_page(ident, 0x02, 0, 0)
+            + _ogg_page(comment + setup, 0x00, 0, 1)
+            + _ogg_page(b"\x00" * 32, 0x04, 44100, 2))
+
+
+WRITERS = {".mp3": mp3_bytes, ".flac": flac_bytes, ".ogg": ogg_bytes}
+
+
+def _safe(name: str) -> str:
+    return name.replace("/", "_").replace("\\", "_")
+
+
+def generate_library(root: str, files: int, seed: int = 1, collab_share: float = 0.15) -> dict:
+    """
+    Создаёт библиотеку из files файлов в root. Если в root уже лежит библиотека
+    с теми же параметрами, она используется повторно.
+    """
+    params = {"files": files, "seed": seed, "collab_share": collab_share}
+    marker = os.path.join(root, MARKER_FILE)
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as f:
+            if json.load(f) == params:
+                return params
+
+    rng = random.Random(seed)
+    artists = make_artists(max(1, files // 25), rng)
+    extensions = list(FORMAT_WEIGHTS)
+    weights = list(FORMAT_WEIGHTS.values())
+
+    written = 0
+    while written < files:
+        artist = rng.choice(artists)
+        if rng.random() < collab_share:
+            artist = artist + rng.choice(COLLAB_JOINERS) + rng.choice(artists)
+        for album_no in range(rng.randint(*ALBUMS_PER_ARTIST)):
+            album = f"{make_name(rng, (1, 2))} ({rng.randint(1970, 2025)})"
+            album_dir = os.path.join(root, _safe(artist), _safe(album))
+            os.makedirs(album_dir, exist_ok=True)
+            for track_no in range(1, rng.randint(*TRACKS_PER_ALBUM) + 1):
+                if written >= files:
+                    break
+                title = make_name(rng, (1, 4))
+                ext = rng.choices(extensions, weights)[0]
+                path = os.path.join(album_dir, f"{track_no:02d} - {_safe(title)}{ext}")
+                with open(path, "wb") as f:
+                    f.write(WRITERS[ext](artist, title))
+                written += 1
+
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--collab-share", type=float, default=0.15)
+    args = parser.parse_args()
+    generate_library(args.root, args.files, args.seed, args.collab_share)
+    print(f"Готово: {args.files} файлов в {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,22 +8,37 @@
 - Поддержка команд:
     • "найди артиста ..." → воспроизводит ВСЮ ДИСКОГРАФИЮ
     • "включи радио ..." → радио + don't stop the music
+    • "включи песню ..." → ищет трек по названию (и артисту)
     • "просканируй музыку" → фоновое сканирование
-    • "статус сканирования" → показывает прогресс
-- Интеграция с Home Assistant
+    • "статус сканирования" → показывает прогресс (этап, файлов/с, ETA)
+- Интеграция с Home Assistant (запросы уходят в фоне, подтверждение звучит сразу)
 - Кэширование базы
+- Инкрементальное пересканирование по манифесту (размер + mtime файла)
 - Автоматическое уведомление о завершении сканирования
+- Наблюдение за папкой (inotify или опрос) с обновлением только изменённых файлов
+- Компактное хранение треков в памяти (колонки + общая таблица артистов)
+- Кэш и тяжёлые библиотеки загружаются в фоне — импорт плагина не тормозит старт Ирины
 - Версия: 2.7
 
 Автор: mrSaT13
 """
 
 import os
+import re
 import json
+import importlib
+import sqlite3
+import heapq
+import queue
 import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from contextlib import closing
+from functools import lru_cache
 from pathlib import Path
-import requests
-from mutagen import File as MutagenFile
+from pickle import PicklingError
 
 # === Поддерживаемые форматы ===
 SUPPORTED_EXTENSIONS = {'.mp3', '.flac', '.m4a', '.ogg', '.wav'}
@@ -40,20 +55,426 @@ PHONETIC_MAP = {
 
 EXCEPTIONS = {"eminem": "эминем", "bts": "бтс"} # === примеры(можно и нужно дополнить по желанию) ===
 
+def _compile_phonetic(mapping: dict):
+    """
+    Собирает транслитератор один раз при импорте.
+    Многобуквенные сочетания ("ch", "ee"...) заменяются одной регуляркой-альтернацией
+    (самое длинное совпадение), одиночные буквы — одним str.translate.
+    Отдельно ищутся «конфликтные» стыки пересекающихся сочетаний, где левое сочетание
+    в исходном порядке замен идёт позже правого (например "iee": сначала заменялось "ee", а не "ie").
+    Для таких строк однопроходная замена дала бы другой результат, поэтому они идут старым путём.
+    """
+    keys = sorted(mapping.keys(), key=len, reverse=True)
+    multi = [k for k in keys if len(k) > 1]
+    multi_re = re.compile("|".join(re.escape(k) for k in multi)) if multi else None
+    single_table = str.maketrans({k: v for k, v in mapping.items() if len(k) == 1})
+    priority = {k: i for i, k in enumerate(keys)}
+    conflicts = set()
+    for left in multi:
+        for right in multi:
+            if priority[right] >= priority[left]:
+                continue
+            for overlap in range(1, min(len(left), len(right))):
+                if left[-overlap:] == right[:overlap]:
+                    conflicts.add(left + right[overlap:])
+    conflict_re = re.compile("|".join(re.escape(c) for c in sorted(conflicts))) if conflicts else None
+    return keys, multi_re, single_table, conflict_re
+
+_PHONETIC_KEYS, _PHONETIC_MULTI_RE, _PHONETIC_SINGLE, _PHONETIC_CONFLICT_RE = _compile_phonetic(PHONETIC_MAP)
+
+def _transliterate_sequential(text: str) -> str:
+    # Исходный алгоритм: по одному str.replace на каждый ключ
+    for eng in _PHONETIC_KEYS:
+        text = text.replace(eng, PHONETIC_MAP[eng].upper())
+    return text.lower()
+
+def _multi_repl(match) -> str:
+    return PHONETIC_MAP[match.group(0)]
+
+@lru_cache(maxsize=65536)
+def _transliterate(text: str) -> str:
+    if _PHONETIC_CONFLICT_RE is not None and _PHONETIC_CONFLICT_RE.search(text):
+        return _transliterate_sequential(text)
+    if _PHONETIC_MULTI_RE is not None:
+        text = _PHONETIC_MULTI_RE.sub(_multi_repl, text)
+    # Кириллица после первого шага в таблицу не попадает — повторной замены нет
+    return text.translate(_PHONETIC_SINGLE).lower()
+
 def eng_to_ru_phonetic(name: str) -> str:
     if not name or not isinstance(name, str):
         return ""
     name_clean = name.lower().strip()
     if name_clean in EXCEPTIONS:
         return EXCEPTIONS[name_clean]
-    temp = name_clean
-    for eng in sorted(PHONETIC_MAP.keys(), key=len, reverse=True):
-        ru = PHONETIC_MAP[eng]
-        temp = temp.replace(eng, ru.upper())
-    return temp.lower()
+    return _transliterate(name_clean)
+
+def _load_phonetic_exceptions():
+    """Дополняет EXCEPTIONS из пользовательского файла {"english name": "русское произношение"}."""
+    path = config.get("phonetic_exceptions_file", "")
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for eng, ru in data.items():
+            if isinstance(eng, str) and isinstance(ru, str) and eng.strip():
+                EXCEPTIONS[eng.lower().strip()] = ru.lower()
+    except Exception as e:
+        print(f"[MusicSearch] Ошибка загрузки исключений фонетики: {e}")
+
+def _apply_exceptions(index: dict) -> dict:
+    # Индекс мог быть посчитан до того, как пользователь дописал исключения
+    phonetic = index["phonetic"]
+    for i, artist in enumerate(index["artists"]):
+        key = artist.lower().strip()
+        if key in EXCEPTIONS:
+            phonetic[i] = EXCEPTIONS[key]
+    return index
+
+# === Компактная таблица треков ===
+class _TrackTable:
+    """
+    Треки в колонках вместо отдельного словаря на каждый трек.
+    Имя и фонетика артиста хранятся один раз в общей таблице, у трека — только номер артиста,
+    название и фонетика названия. search_name и search_ru собираются при обращении.
+    Снаружи ведёт себя как прежний список: len(), индекс, перебор дают словари
+    {"artist", "title", "search_name", "search_ru"}. Удалённый наблюдателем трек оставляет
+    пустую позицию (None), чтобы id остальных треков в индексах не сдвигались;
+    при свёртке журнала позиции уплотняются (compacted).
+    """
+    __slots__ = ("_artists", "_artists_ru", "_artist_pos", "_artist_ids", "_titles", "_titles_ru",
+                 "_ru_overrides", "_free")
+
+    def __init__(self):
+        self._artists = []
+        self._artists_ru = []
+        self._artist_pos = {}
+        self._artist_ids = array("I")
+        self._titles = []
+        self._titles_ru = []
+        # Редкие треки, у которых фонетика целой строки не равна склейке частей
+        # (исключение на всю строку, пробелы по краям, особые правила lower())
+        self._ru_overrides = {}
+        # Свободные позиции — их занимают новые треки
+        self._free = set()
+
+    @classmethod
+    def from_dicts(cls, tracks) -> "_TrackTable":
+        table = cls()
+        for t in tracks:
+            if t is None:
+                table._append_free()
+            else:
+                table.append(t["artist"], t["title"], t.get("search_ru"))
+        return table
+
+    def _append_free(self):
+        self._free.add(len(self._titles))
+        self._artist_ids.append(0)
+        self._titles.append(None)
+        self._titles_ru.append(None)
+
+    def append(self, artist: str, title: str, search_ru: str = None):
+        self._append_free()
+        self.set(len(self._titles) - 1, artist, title, search_ru)
+
+    def set(self, i: int, artist: str, title: str, search_ru: str = None):
+        """Записывает трек в позицию i — свободную, занятую (замена) или за концом таблицы."""
+        while len(self._titles) <= i:
+            self._append_free()
+        self._free.discard(i)
+        pos = self._artist_pos.get(artist)
+        if pos is None:
+            pos = len(self._artists)
+            self._artist_pos[artist] = pos
+            self._artists.append(artist)
+            self._artists_ru.append(_transliterate(artist.lower()))
+        title_ru = _transliterate(title.lower())
+        self._artist_ids[i] = pos
+        self._titles[i] = title
+        self._titles_ru[i] = title_ru
+        self._ru_overrides.pop(i, None)
+
+        # Сочетания фонетики не пересекают " - ", поэтому фонетика строки = склейка частей.
+        # Проверяем целиком только там, где это может не выполняться
+        joined = f"{self._artists_ru[pos]} - {title_ru}"
+        if search_ru is None:
+            full = f"{artist} - {title}"
+            clean = full.lower()
+            if (clean != clean.strip() or clean in EXCEPTIONS
+                    or clean != f"{artist.lower()} - {title.lower()}"):
+                search_ru = eng_to_ru_phonetic(full)
+        if search_ru is not None and search_ru != joined:
+            self._ru_overrides[i] = search_ru
+
+    def remove(self, i: int):
+        """Освобождает позицию; остальные треки не сдвигаются."""
+        self._titles[i] = None
+        self._titles_ru[i] = None
+        self._ru_overrides.pop(i, None)
+        self._free.add(i)
+
+    def allocate(self) -> int:
+        """Позиция для нового трека: наименьшая свободная или конец таблицы."""
+        return min(self._free) if self._free else len(self._titles)
+
+    def free_count(self) -> int:
+        """Число пустых позиций (удалённых треков)."""
+        return len(self._free)
+
+    def compacted(self):
+        """
+        Таблица без пустых позиций и отображение старых id в новые (None — удалённый трек).
+        Фонетика переносится как есть, без пересчёта.
+        """
+        table = _TrackTable()
+        table._artists = list(self._artists)
+        table._artists_ru = list(self._artists_ru)
+        table._artist_pos = dict(self._artist_pos)
+        new_ids = [None] * len(self._titles)
+        for i, title in enumerate(self._titles):
+            if title is None:
+                continue
+            n = len(table._titles)
+            new_ids[i] = n
+            table._artist_ids.append(self._artist_ids[i])
+            table._titles.append(title)
+            table._titles_ru.append(self._titles_ru[i])
+            override = self._ru_overrides.get(i)
+            if override is not None:
+                table._ru_overrides[n] = override
+        return table, new_ids
+
+    def artist_counts(self) -> Counter:
+        """Число треков у каждого артиста (без удалённых)."""
+        counts = Counter(pos for pos, title in zip(self._artist_ids, self._titles) if title is not None)
+        return Counter({self._artists[pos]: n for pos, n in counts.items()})
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self._titles)
+        title = self._titles[i]
+        if title is None:
+            return None
+        artist = self._artists[self._artist_ids[i]]
+        return {
+            "artist": artist,
+            "title": title,
+            "search_name": f"{artist} - {title}",
+            "search_ru": self.search_ru(i),
+        }
+
+    def __iter__(self):
+        for i in range(len(self._titles)):
+            yield self[i]
+
+    def search_ru(self, i: int) -> str:
+        override = self._ru_overrides.get(i)
+        if override is not None:
+            return override
+        title_ru = self._titles_ru[i]
+        if title_ru is None:
+            return None
+        return f"{self._artists_ru[self._artist_ids[i]]} - {title_ru}"
+
+    def iter_search_ru(self):
+        """Фонетика треков по порядку — для индекса n-грамм, без сборки словарей."""
+        return map(self.search_ru, range(len(self._titles)))
+
+# === Быстрое чтение тегов из заголовка файла ===
+# Читаются только нужные кадры/блоки/атомы, всё остальное (обложки, аудио) пропускается seek'ом.
+# Любой непонятный случай → _FastTagError, и файл разбирает mutagen.
+_FAST_TAG_MAX_ITEM = 64 * 1024      # больше этого artist/title быть не может
+_FAST_TAG_MAX_COMMENTS = 1024 * 1024  # блок комментариев FLAC (бывают тексты песен)
+_FAST_TAG_MAX_BLOCKS = 256          # защита от битых файлов с бесконечной цепочкой блоков
+_MP4_CONTAINERS = (b"moov", b"udta", b"meta", b"ilst")
+
+class _FastTagError(Exception):
+    pass
+
+def _read_exact(f, size: int) -> bytes:
+    if size < 0 or size > _FAST_TAG_MAX_ITEM:
+        raise _FastTagError("слишком большой блок")
+    data = f.read(size)
+    if len(data) != size:
+        raise _FastTagError("файл обрезан")
+    return data
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def _decode_id3_text(data: bytes) -> str:
+    encoding, body = data[0], data[1:]
+    if encoding == 0:
+        text = body.decode("latin-1")
+    elif encoding == 1:
+        text = body.decode("utf-16")
+    elif encoding == 2:
+        text = body.decode("utf-16-be")
+    elif encoding == 3:
+        text = body.decode("utf-8")
+    else:
+        raise _FastTagError("неизвестная кодировка ID3")
+    # Несколько значений разделены нулём — как и mutagen, берём первое
+    return text.split("\x00")[0]
+
+def _read_id3v2(f, header: bytes):
+    major = header[3]
+    tag_flags = header[5]
+    tag_end = 10 + _syncsafe(header[6:10])
+    if major not in (2, 3, 4) or tag_flags & 0x80:
+        # Несинхронизация всего тега — кадры нельзя читать по отдельности
+        raise _FastTagError("ID3 с несинхронизацией")
+
+    if major == 2:
+        wanted = {b"TP1": "artist", b"TT2": "title"}
+        frame_header_size, id_size = 6, 3
+    else:
+        wanted = {b"TPE1": "artist", b"TIT2": "title"}
+        frame_header_size, id_size = 10, 4
+
+    pos = 10
+    if major >= 3 and tag_flags & 0x40:
+        ext = _read_exact(f, 4)
+        ext_size = _syncsafe(ext) if major == 4 else int.from_bytes(ext, "big") + 4
+        pos += ext_size
+        f.seek(pos)
+
+    found = {}
+    while pos + frame_header_size <= tag_end and len(found) < len(wanted):
+        frame_header = _read_exact(f, frame_header_size)
+        frame_id = frame_header[:id_size]
+        if not frame_id.strip(b"\x00"):
+            break  # паддинг
+        if major == 2:
+            size = int.from_bytes(frame_header[3:6], "big")
+        elif major == 3:
+            size = int.from_bytes(frame_header[4:8], "big")
+        else:
+            size = _syncsafe(frame_header[4:8])
+        pos += frame_header_size
+        if pos + size > tag_end:
+            raise _FastTagError("кадр ID3 выходит за пределы тега")
+        if frame_id in wanted:
+            if major >= 3 and frame_header[9] & (0x0F if major == 4 else 0xE0):
+                raise _FastTagError("сжатый/зашифрованный кадр ID3")
+            found[wanted[frame_id]] = _decode_id3_text(_read_exact(f, size)) if size else ""
+        else:
+            f.seek(pos + size)
+        pos += size
+    return found.get("artist", ""), found.get("title", "")
+
+def _read_flac(f):
+    found = {}
+    for _ in range(_FAST_TAG_MAX_BLOCKS):
+        block_header = _read_exact(f, 4)
+        is_last = block_header[0] & 0x80
+        block_type = block_header[0] & 0x7F
+        size = int.from_bytes(block_header[1:4], "big")
+        if block_type == 4:  # VORBIS_COMMENT
+            if size > _FAST_TAG_MAX_COMMENTS:
+                raise _FastTagError("слишком большой блок комментариев")
+            data = f.read(size)
+            if len(data) != size:
+                raise _FastTagError("файл обрезан")
+            vendor_len = int.from_bytes(data[0:4], "little")
+            pos = 4 + vendor_len
+            count = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+            for _ in range(count):
+                length = int.from_bytes(data[pos:pos + 4], "little")
+                pos += 4
+                key, sep, value = data[pos:pos + length].decode("utf-8").partition("=")
+                pos += length
+                key = key.lower()
+                if sep and key in ("artist", "title") and key not in found:
+                    found[key] = value
+            return found.get("artist", ""), found.get("title", "")
+        if is_last:
+            break
+        f.seek(size, os.SEEK_CUR)  # обложки и таблицы пропускаем без чтения
+    raise _FastTagError("в FLAC нет блока комментариев")
+
+def _mp4_atoms(f, start: int, end: int):
+    """Перебирает атомы уровня [start, end): (тип, начало данных, конец атома)."""
+    pos = start
+    for _ in range(_FAST_TAG_MAX_BLOCKS):
+        if pos + 8 > end:
+            return
+        f.seek(pos)
+        head = _read_exact(f, 8)
+        size = int.from_bytes(head[:4], "big")
+        kind = head[4:8]
+        data_start = pos + 8
+        if size == 1:
+            size = int.from_bytes(_read_exact(f, 8), "big")
+            data_start += 8
+        elif size == 0:
+            size = end - pos
+        if size < data_start - pos or pos + size > end:
+            raise _FastTagError("битый атом MP4")
+        yield kind, data_start, pos + size
+        pos += size
+
+def _read_mp4(f):
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+    start, end = 0, file_end
+    # moov → udta → meta → ilst; mdat и прочее перескакиваем, не читая
+    for container in _MP4_CONTAINERS:
+        for kind, data_start, atom_end in _mp4_atoms(f, start, end):
+            if kind == container:
+                # meta — "полный" атом: 4 байта версии/флагов перед дочерними
+                start, end = (data_start + 4 if kind == b"meta" else data_start), atom_end
+                break
+        else:
+            raise _FastTagError("в MP4 нет атома " + container.decode())
+
+    wanted = {b"\xa9ART": "artist", b"\xa9nam": "title"}
+    found = {}
+    for kind, data_start, atom_end in _mp4_atoms(f, start, end):
+        if kind not in wanted or wanted[kind] in found:
+            continue
+        for data_kind, value_start, value_end in _mp4_atoms(f, data_start, atom_end):
+            if data_kind != b"data":
+                continue
+            f.seek(value_start)
+            payload = _read_exact(f, value_end - value_start)
+            if int.from_bytes(payload[1:4], "big") != 1:
+                raise _FastTagError("нетекстовое значение MP4")
+            found[wanted[kind]] = payload[8:].decode("utf-8")
+            break
+    return found.get("artist", ""), found.get("title", "")
+
+def _fast_tags(filepath: str):
+    """Теги из заголовка файла без полного разбора контейнера; None — формат не поддерживается."""
+    # Без буферизации: читаем ровно столько байт, сколько запросили (важно для сетевых папок)
+    with open(filepath, "rb", buffering=0) as f:
+        header = f.read(10)
+        if len(header) < 10:
+            return None
+        if header[:3] == b"ID3" and Path(filepath).suffix.lower() == ".mp3":
+            return _read_id3v2(f, header)
+        if header[:4] == b"fLaC":
+            f.seek(4)
+            return _read_flac(f)
+        if header[4:8] == b"ftyp":
+            return _read_mp4(f)
+    return None
 
 def extract_tags(filepath: str):
+    if config.get("fast_tags", True):
+        try:
+            tags = _fast_tags(filepath)
+            if tags and (tags[0] or tags[1]):
+                return tags[0].strip(), tags[1].strip()
+        except Exception:
+            pass  # быстрый путь не справился — разбираем mutagen
     try:
+        from mutagen import File as MutagenFile
         audio = MutagenFile(filepath, easy=True)
         if not audio or not audio.tags:
             return "", ""
@@ -73,49 +494,1069 @@ config = {
     "ha_url": "http://localhost:8123",
     "ha_token": "",
     "ha_entity_id": "media_player.your_speaker",
+    "ha_timeout": 10,             # сек на запрос к Home Assistant (выполняется в фоне)
     "min_similarity": 85,
     "use_intro_phrases": True,
+    # Пул чтения тегов при сканировании:
+    # "thread" — для сетевых папок (упор в I/O), "process" — для локальных FLAC/M4A (упор в CPU)
+    "scan_pool": "thread",
+    "scan_workers": 0,        # 0 — по числу ядер
+    "scan_batch_size": 256,
+    # Читать теги прямо из заголовка (ID3v2, FLAC, MP4) без полного разбора mutagen
+    "fast_tags": True,
+    # Хранилище кэша: "json" — один файл, "sqlite" — база, поиск песни запросом к ней (для больших библиотек)
+    "cache_backend": "json",
+    # Свои исключения произношения: JSON {"the weeknd": "зе уикенд", ...}
+    "phonetic_exceptions_file": "music_phonetic_exceptions.json",
+    # Наблюдение за папкой: "off", "auto", "inotify" (нужен inotify_simple) или "poll" (сетевые папки)
+    "watch_mode": "off",
+    "watch_debounce": 3.0,        # сек тишины после пачки событий inotify
+    "watch_poll_interval": 60,    # сек между опросами в режиме poll
+    "watch_poll_file_check": 600, # сек, за которые опрос по кругу сверяет с манифестом все файлы (0 — не сверять)
+    # Сколько секунд команда ждёт фоновую загрузку кэша при старте Ирины
+    "load_timeout": 10,
 }
 
 config_comment = """
 Команды:
 - "найди артиста ..." → воспроизводит всю дискографию
 - "включи радио ..." → радио + don't stop the music
+- "включи песню ..." → воспроизводит найденный трек
 - "просканируй музыку" → обновляет кэш
-- "статус сканирования" → проверяет, завершено ли сканирование
+- "статус сканирования" → этап, прочитано файлов, скорость и оставшееся время
+  (те же данные пишутся в music_scan_status.json)
 
 Настройки:
 - music_folder: путь к папке с музыкой
 - ha_url / ha_token / ha_entity_id: данные Home Assistant
+- ha_timeout: таймаут запроса к HA; запросы идут из фоновой очереди, об ошибке Ирина скажет отдельно
+  (глубина очереди и задержки — в music_ha_status.json)
+- scan_pool: "thread" (сетевые папки) или "process" (локальный диск, много FLAC/M4A)
+- scan_workers: число воркеров чтения тегов (0 — по числу ядер)
+- scan_batch_size: сколько файлов отдаётся воркеру за раз
+- fast_tags: быстрое чтение тегов из заголовка файла (mutagen — только если не получилось)
+- cache_backend: "json" или "sqlite" (при первом запуске с sqlite JSON-манифест и кэш переносятся в базу)
+- phonetic_exceptions_file: JSON-файл с дополнительными исключениями произношения
+- watch_mode: следить за папкой и обновлять кэш без полного сканирования
+  ("auto" — inotify, если установлен inotify_simple, иначе опрос; "poll" — для сетевых папок)
+- watch_debounce / watch_poll_interval: задержка сброса событий inotify и период опроса
+- watch_poll_file_check: за сколько секунд опрос сверяет размер и mtime всех файлов с манифестом
+  (так находятся файлы, перезаписанные на месте, например после смены тегов; 0 — не сверять)
+- load_timeout: сколько секунд команда ждёт фоновую загрузку кэша после старта
 """
 
 # === Глобальное состояние ===
 _cache_file = "music_cache_v2_7.json"
-_cache = {"pure_artists": set(), "tracks": []}
+# Манифест файлов: путь → размер, mtime и извлечённые artist/title.
+# Позволяет при повторном сканировании парсить только новые и изменённые файлы.
+_manifest_file = "music_manifest_v2_7.json"
+_db_file = "music_cache_v2_7.db"
+# Журнал точечных изменений манифеста (режим json): наблюдатель дописывает строки
+# {"path", "entry"}, а когда их накопится много — сворачивает в манифест и кэш
+_journal_file = "music_manifest_v2_7.journal"
+_JOURNAL_COMPACT_MIN = 1000
+_journal_ops = 0
+# Манифест в памяти для наблюдателя (режим json): путь → (размер, mtime, id трека)
+_files = None
+_cache = {"pure_artists": set(), "tracks": _TrackTable(), "artist_index": {"artists": [], "phonetic": []}, "track_index": None}
 _scan_lock = threading.Lock()
+# Сериализует изменения манифеста: полное сканирование и наблюдатель за папкой
+_library_lock = threading.Lock()
 _scan_thread = None
 _scan_in_progress = False
+# Выставляется, когда фоновая загрузка кэша при старте закончилась
+_cache_ready = threading.Event()
+# С какими настройками загружен кэш: Ирина применяет сохранённые настройки уже после импорта,
+# и фоновая загрузка могла успеть прочитать значения по умолчанию
+_loaded_settings = None
+_reload_lock = threading.Lock()
+
+def _use_sqlite() -> bool:
+    return config.get("cache_backend", "json") == "sqlite"
+
+# === SQLite-хранилище ===
+# Версия схемы хранится в PRAGMA user_version; базу другой версии пересобираем из JSON
+_DB_VERSION = 2
+_DB_TABLES = ("tracks", "artists", "files", "track_grams")
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    search_name TEXT NOT NULL,
+    search_ru TEXT NOT NULL
+);
+-- Остались ли у артиста треки — при точечном удалении файлов
+CREATE INDEX IF NOT EXISTS idx_tracks_artist ON tracks(artist);
+-- Первичный ключ по имени: артисты читаются сразу в порядке _build_artist_index
+CREATE TABLE IF NOT EXISTS artists (
+    artist TEXT PRIMARY KEY,
+    phonetic TEXT NOT NULL
+) WITHOUT ROWID;
+-- Манифест файлов (в режиме json это music_manifest_v2_7.json)
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    track_id INTEGER NOT NULL
+) WITHOUT ROWID;
+-- Триграммный индекс фонетики треков: id треков — array("I") по возрастанию.
+-- Поиск песни читает только строки триграмм запроса, а не все треки
+CREATE TABLE IF NOT EXISTS track_grams (
+    gram TEXT PRIMARY KEY,
+    ids BLOB NOT NULL
+);
+"""
+_db_ready = False
+_db_init_lock = threading.Lock()
+
+def _db_init():
+    """Создаёт схему один раз за запуск. Пустая база или база старого формата заполняется из JSON."""
+    global _db_ready
+    with _db_init_lock:
+        if _db_ready:
+            return
+        with closing(sqlite3.connect(_db_file, timeout=30)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] == _DB_VERSION:
+                # Схема прежней версии — досоздаём появившиеся с тех пор индексы
+                conn.executescript(_DB_SCHEMA)
+            else:
+                for table in _DB_TABLES:
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.executescript(_DB_SCHEMA)
+                try:
+                    _db_import_json(conn)
+                    # Версию ставим последней: прерванный перенос повторится при следующем запуске
+                    conn.execute(f"PRAGMA user_version = {_DB_VERSION}")
+                except Exception as e:
+                    print(f"[MusicSearch] Ошибка переноса кэша в SQLite: {e}")
+        _db_ready = True
+
+def _db_connect() -> sqlite3.Connection:
+    # Отдельное соединение на вызов: сканер и обработчики работают в разных потоках
+    _db_init()
+    conn = sqlite3.connect(_db_file, timeout=30)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _db_write_library(conn: sqlite3.Connection, manifest: dict, tracks, artist_index: dict):
+    """
+    Полностью заменяет содержимое базы одной транзакцией.
+    id трека = его позиция в таблице; у записи манифеста — "id" или её порядковый номер.
+    """
+    track_grams = _build_ngram_index(enumerate(tracks.iter_search_ru()))["grams"]
+    with conn:
+        for table in _DB_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.executemany(
+            "INSERT INTO tracks (id, artist, title, search_name, search_ru) VALUES (?, ?, ?, ?, ?)",
+            ((i, t["artist"], t["title"], t["search_name"], t["search_ru"])
+             for i, t in enumerate(tracks) if t is not None)
+        )
+        conn.executemany(
+            "INSERT INTO artists (artist, phonetic) VALUES (?, ?)",
+            zip(artist_index["artists"], artist_index["phonetic"])
+        )
+        conn.executemany(
+            "INSERT INTO files (path, size, mtime, track_id) VALUES (?, ?, ?, ?)",
+            ((path, e["size"], e["mtime"], e.get("id", i)) for i, (path, e) in enumerate(manifest.items()))
+        )
+        conn.executemany(
+            "INSERT INTO track_grams (gram, ids) VALUES (?, ?)",
+            ((gram, ids.tobytes()) for gram, ids in track_grams.items())
+        )
+
+def _db_save(manifest: dict, tracks, artist_index: dict):
+    with closing(_db_connect()) as conn:
+        _db_write_library(conn, manifest, tracks, artist_index)
+
+def _db_import_json(conn: sqlite3.Connection):
+    """Перенос JSON-манифеста (или, если его нет, music_cache_v2_7.json) в новую базу."""
+    manifest = _load_manifest_json()
+    if manifest:
+        pure_artists, tracks = _derive_library(manifest)
+    elif os.path.exists(_cache_file):
+        with open(_cache_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        pure_artists = set(data.get("pure_artists", []))
+        # Без манифеста путей нет — файлы перечитаются при следующем сканировании
+        tracks = _TrackTable.from_dicts(data.get("tracks", []))
+    else:
+        return
+    _db_write_library(conn, manifest, tracks, _build_artist_index(pure_artists))
+    print(f"[MusicSearch] Кэш перенесён в {_db_file}")
+
+def _db_apply_changes(changes: list):
+    """
+    Точечные изменения одной транзакцией: строки files и tracks только изменившихся файлов,
+    списки id только их триграмм. Возвращает (появившиеся, пропавшие) чистые артисты.
+    """
+    gram_add = defaultdict(set)
+    gram_del = defaultdict(set)
+    touched = set()
+    with closing(_db_connect()) as conn, conn:
+        next_id = conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM tracks").fetchone()[0]
+        for path, entry in changes:
+            row = conn.execute("SELECT track_id FROM files WHERE path = ?", (path,)).fetchone()
+            track_id = row[0] if row else None
+            if row:
+                old = conn.execute("SELECT artist, search_ru FROM tracks WHERE id = ?", (track_id,)).fetchone()
+                if old:
+                    touched.add(old[0])
+                    for gram in _ngrams(old[1]):
+                        gram_del[gram].add(track_id)
+                    conn.execute("DELETE FROM tracks WHERE id = ?", (track_id,))
+            if entry is None:
+                if row:
+                    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                continue
+            if track_id is None:
+                track_id = next_id
+                next_id += 1
+            artist, title = entry["artist"], entry["title"]
+            search_name = f"{artist} - {title}"
+            search_ru = eng_to_ru_phonetic(search_name)
+            conn.execute(
+                "INSERT INTO tracks (id, artist, title, search_name, search_ru) VALUES (?, ?, ?, ?, ?)",
+                (track_id, artist, title, search_name, search_ru)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, track_id) VALUES (?, ?, ?, ?)",
+                (path, entry["size"], entry["mtime"], track_id)
+            )
+            for gram in _ngrams(search_ru):
+                gram_add[gram].add(track_id)
+                gram_del[gram].discard(track_id)
+            touched.add(artist)
+
+        for gram in gram_add.keys() | gram_del.keys():
+            row = conn.execute("SELECT ids FROM track_grams WHERE gram = ?", (gram,)).fetchone()
+            ids = array("I")
+            if row:
+                ids.frombytes(row[0])
+            removed = gram_del.get(gram)
+            if removed:
+                ids = array("I", (i for i in ids if i not in removed))
+            added = gram_add.get(gram)
+            if added and (not ids or min(added) > ids[-1]):
+                # Новые треки получают id больше всех прежних — дописываем в конец
+                ids.extend(sorted(added))
+            elif added:
+                ids = array("I", sorted(set(ids).union(added)))
+            if ids:
+                conn.execute("INSERT OR REPLACE INTO track_grams (gram, ids) VALUES (?, ?)", (gram, ids.tobytes()))
+            else:
+                conn.execute("DELETE FROM track_grams WHERE gram = ?", (gram,))
+
+        appeared, vanished = set(), set()
+        for artist in touched:
+            if not artist or not _is_pure_artist(artist):
+                continue
+            alive = conn.execute("SELECT 1 FROM tracks WHERE artist = ? LIMIT 1", (artist,)).fetchone()
+            known = conn.execute("SELECT 1 FROM artists WHERE artist = ?", (artist,)).fetchone()
+            if alive and not known:
+                conn.execute("INSERT INTO artists (artist, phonetic) VALUES (?, ?)", (artist, eng_to_ru_phonetic(artist)))
+                appeared.add(artist)
+            elif known and not alive:
+                conn.execute("DELETE FROM artists WHERE artist = ?", (artist,))
+                vanished.add(artist)
+    return appeared, vanished
+
+def _db_manifest_paths(path: str) -> list:
+    # Все пути внутри папки — диапазон по первичному ключу: от "папка/" до "папка0" ("0" идёт сразу за "/")
+    prefix = path.rstrip(os.sep) + os.sep
+    upper = prefix[:-1] + chr(ord(os.sep) + 1)
+    with closing(_db_connect()) as conn:
+        rows = conn.execute(
+            "SELECT path FROM files WHERE path = ? OR (path >= ? AND path < ?)", (path, prefix, upper)
+        ).fetchall()
+    return [r[0] for r in rows]
+
+def _db_manifest_lookup(paths: list) -> dict:
+    found = {}
+    with closing(_db_connect()) as conn:
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = conn.execute(
+                f"SELECT path, size, mtime FROM files WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update((r[0], (r[1], r[2])) for r in rows)
+    return found
+
+def _db_load_artist_index() -> dict:
+    with closing(_db_connect()) as conn:
+        rows = conn.execute("SELECT artist, phonetic FROM artists ORDER BY artist").fetchall()
+    return {"artists": [r[0] for r in rows], "phonetic": [r[1] for r in rows]}
+
+def _db_load_manifest() -> dict:
+    with closing(_db_connect()) as conn:
+        rows = conn.execute(
+            "SELECT f.path, f.size, f.mtime, t.artist, t.title FROM files f JOIN tracks t ON t.id = f.track_id"
+        ).fetchall()
+    return {r[0]: {"size": r[1], "mtime": r[2], "artist": r[3], "title": r[4]} for r in rows}
+
+def _db_track_candidates(query: str, limit: int) -> list:
+    """То же, что _ngram_candidates по индексу треков, но списки id читаются из базы — только нужные."""
+    query_grams = list(_ngrams(query))
+    with closing(_db_connect()) as conn:
+        sizes = conn.execute(
+            f"SELECT gram, length(ids) / 4 FROM track_grams WHERE gram IN ({','.join('?' * len(query_grams))})",
+            query_grams
+        ).fetchall()
+        if not sizes:
+            return []
+        count = conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM tracks").fetchone()[0]
+        max_df = max(1, int(count * _NGRAM_MAX_SHARE))
+        selective = [gram for gram, df in sizes if df <= max_df] or [min(sizes, key=lambda r: r[1])[0]]
+        rows = conn.execute(
+            f"SELECT ids FROM track_grams WHERE gram IN ({','.join('?' * len(selective))})", selective
+        ).fetchall()
+    hits = Counter()
+    for (blob,) in rows:
+        ids = array("I")
+        ids.frombytes(blob)
+        hits.update(ids)
+    return [item_id for item_id, _ in hits.most_common(limit)]
+
+def _db_has_tracks() -> bool:
+    with closing(_db_connect()) as conn:
+        return conn.execute("SELECT 1 FROM tracks LIMIT 1").fetchone() is not None
+
+def _db_get_tracks(ids: list) -> list:
+    if not ids:
+        return []
+    with closing(_db_connect()) as conn:
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(
+            f"SELECT id, artist, title, search_name, search_ru FROM tracks WHERE id IN ({placeholders})",
+            ids
+        ).fetchall()
+    by_id = {r[0]: {"artist": r[1], "title": r[2], "search_name": r[3], "search_ru": r[4]} for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+def _get_artist_index() -> dict:
+    """Индекс артистов; в режиме sqlite читается из базы при первом обращении."""
+    cache = _cache
+    index = cache["artist_index"]
+    if index is None:
+        generation = cache.get("generation", 0)
+        index = _apply_exceptions(_db_load_artist_index())
+        with _scan_lock:
+            # Пока читали базу, сканер мог сохранить новый индекс, а наблюдатель — изменить базу
+            if cache["artist_index"] is None and cache.get("generation", 0) == generation:
+                cache["artist_index"] = index
+                cache["pure_artists"] = set(index["artists"])
+            if cache["artist_index"] is not None:
+                index = cache["artist_index"]
+    return index
+
+def _cache_settings() -> tuple:
+    return config.get("cache_backend", "json"), config.get("phonetic_exceptions_file", "")
+
+def _ensure_cache_current():
+    """Перечитывает кэш, если хранилище или файл исключений сменились после загрузки."""
+    if _cache_settings() == _loaded_settings:
+        return
+    with _reload_lock:
+        if _cache_settings() != _loaded_settings:
+            print("[MusicSearch] Настройки кэша изменились после загрузки, перечитываю кэш")
+            _load_cache()
 
 def _load_cache():
-    global _cache
+    global _cache, _files, _loaded_settings
+    _loaded_settings = _cache_settings()
+    # Манифест в памяти относится к прежнему хранилищу
+    _files = None
+    _load_phonetic_exceptions()
+    if _use_sqlite():
+        _db_init()
+        # Треки остаются в базе, индекс артистов подгрузится по первому запросу
+        _cache = {"pure_artists": set(), "tracks": _TrackTable(), "artist_index": None, "track_index": None}
+        return
+    if os.path.exists(_journal_file):
+        # Журнал наблюдателя не успели свернуть — собираем кэш из манифеста с журналом и сворачиваем
+        with _library_lock:
+            manifest = _load_manifest_json()
+            pure_artists, tracks = _derive_library(manifest)
+            _cache = {"pure_artists": pure_artists, "tracks": tracks,
+                      "artist_index": _build_artist_index(pure_artists), "track_index": None}
+            _files = {path: (e["size"], e["mtime"], e["id"]) for path, e in manifest.items()}
+            _compact_json()
+        return
     try:
         with open(_cache_file, "r", encoding="utf-8") as f:
             data = json.load(f)
-            _cache["pure_artists"] = set(data.get("pure_artists", []))
-            _cache["tracks"] = data.get("tracks", [])
+        pure_artists = set(data.get("pure_artists", []))
+        index = data.get("artist_index")
+        if not index or len(index.get("artists", [])) != len(pure_artists):
+            # Кэш старого формата — строим индекс один раз при загрузке
+            index = _build_artist_index(pure_artists)
+        # Новый словарь целиком: при перезагрузке обработчики не увидят смесь старого и нового
+        _cache = {"pure_artists": pure_artists, "tracks": _TrackTable.from_dicts(data.get("tracks", [])),
+                  "artist_index": _apply_exceptions(index), "track_index": None}
     except FileNotFoundError:
-        _cache = {"pure_artists": set(), "tracks": []}
+        _cache = {"pure_artists": set(), "tracks": _TrackTable(), "artist_index": {"artists": [], "phonetic": []}, "track_index": None}
 
 def _save_cache():
     with open(_cache_file, "w", encoding="utf-8") as f:
         json.dump({
             "pure_artists": list(_cache["pure_artists"]),
-            "tracks": _cache["tracks"]
+            # Формат файла прежний — список словарей; они собираются только на время записи
+            "tracks": list(_cache["tracks"]),
+            "artist_index": _cache["artist_index"]
         }, f, ensure_ascii=False, indent=2)
 
+def _build_artist_index(pure_artists, previous: dict = None) -> dict:
+    """
+    Упорядоченный индекс артистов с заранее посчитанной фонетикой.
+    artists[i] ↔ phonetic[i]; порядок не зависит от порядка обхода множества.
+    Фонетика уже известных артистов берётся из предыдущего индекса.
+    """
+    known = dict(zip(previous["artists"], previous["phonetic"])) if previous else {}
+    artists = sorted(pure_artists)
+    phonetic = [known[a] if a in known else eng_to_ru_phonetic(a) for a in artists]
+    return {"artists": artists, "phonetic": phonetic}
+
+# === Индексы n-грамм: символьные триграммы → id треков / артистов ===
+_NGRAM_SIZE = 3
+_TRACK_CANDIDATES = 300
+_ARTIST_CANDIDATES = 300
+# Полный перебор rapidfuzz до ~20k артистов укладывается в миллисекунды и точнее отбора —
+# кандидатов по триграммам отбираем только в библиотеках крупнее
+_ARTIST_PREFILTER_MIN = 20000
+# n-граммы, встречающиеся больше чем в такой доле записей, не сужают поиск — пропускаем их.
+# Для артистов порог ниже: на 100k имён это вдвое быстрее при той же оценке лучшего совпадения
+_NGRAM_MAX_SHARE = 0.2
+_ARTIST_NGRAM_MAX_SHARE = 0.05
+
+def _ngrams(text: str, pad: bool = True) -> set:
+    padded = f" {text} " if pad else text
+    return {padded[i:i + _NGRAM_SIZE] for i in range(len(padded) - _NGRAM_SIZE + 1)}
+
+def _build_ngram_index(rows, pad: bool = True) -> dict:
+    """
+    rows — пары (id, текст), id идут подряд с нуля. Списки id хранятся в компактных array,
+    sizes[id] — число различных n-грамм текста (для нормировки совпадений).
+    Без выравнивания пробелами (pad=False) тексты короче n-граммы не индексируются
+    и попадают в short — их всегда проверяют целиком.
+    """
+    postings = defaultdict(list)
+    sizes = array("H")
+    short = array("I")
+    for item_id, text in rows:
+        if text is None:
+            # Удалённый трек: позиция остаётся, в индекс не попадает
+            sizes.append(0)
+            continue
+        grams = _ngrams(text, pad)
+        sizes.append(min(len(grams), 0xFFFF))
+        if not grams:
+            short.append(item_id)
+        for gram in grams:
+            postings[gram].append(item_id)
+    return {
+        "grams": {gram: array("I", ids) for gram, ids in postings.items()},
+        "sizes": sizes,
+        "short": short,
+        "pad": pad,
+        "count": len(sizes),
+    }
+
+def _ngram_add(index: dict, item_id: int, text: str):
+    """Добавляет запись в готовый индекс (наблюдатель за папкой). Списки id больше не упорядочены."""
+    grams = _ngrams(text, index["pad"])
+    sizes = index["sizes"]
+    while len(sizes) <= item_id:
+        sizes.append(0)
+    sizes[item_id] = min(len(grams), 0xFFFF)
+    for gram in grams:
+        ids = index["grams"].get(gram)
+        if ids is None:
+            index["grams"][gram] = array("I", [item_id])
+        else:
+            ids.append(item_id)
+    index["count"] = len(sizes)
+
+def _ngram_remove(index: dict, item_id: int, text: str):
+    for gram in _ngrams(text, index["pad"]):
+        ids = index["grams"].get(gram)
+        if ids is None:
+            continue
+        try:
+            ids.remove(item_id)
+        except ValueError:
+            continue
+        if not ids:
+            del index["grams"][gram]
+    index["sizes"][item_id] = 0
+
+def _ngram_candidates(index: dict, query: str, limit: int, normalize: bool = False,
+                      max_share: float = _NGRAM_MAX_SHARE) -> list:
+    """
+    Id записей, набравших больше всего общих с запросом n-грамм.
+    normalize=True ранжирует по доле общих n-грамм от меньшей из двух строк — так же,
+    как partial_ratio сравнивает короткую строку с лучшим фрагментом длинной;
+    при равенстве выигрывает меньший id.
+    """
+    grams = index["grams"]
+    query_grams = _ngrams(query, index["pad"])
+    postings = [grams[g] for g in query_grams if g in grams]
+    if not postings:
+        return list(index["short"])
+    max_df = max(1, int(index["count"] * max_share))
+    selective = [p for p in postings if len(p) <= max_df] or [min(postings, key=len)]
+    hits = Counter()
+    for p in selective:
+        hits.update(p)
+    if normalize:
+        sizes = index["sizes"]
+        query_size = len(query_grams)
+        scored = [(-hit / min(sizes[i], query_size), i) for i, hit in hits.items()]
+        return [i for _, i in heapq.nsmallest(limit, scored)] + list(index["short"])
+    return [item_id for item_id, _ in hits.most_common(limit)]
+
+def _get_track_index() -> dict:
+    """
+    Индекс треков в памяти (режим json) строится при сканировании; после загрузки кэша —
+    при первом запросе. В режиме sqlite триграммы лежат в базе — см. _db_track_candidates.
+    """
+    cache = _cache
+    index = cache["track_index"]
+    if index is None:
+        tracks = cache["tracks"]
+        generation = cache.get("generation", 0)
+        index = _build_ngram_index(enumerate(tracks.iter_search_ru()))
+        with _scan_lock:
+            # Индекс от старого списка треков не должен затереть построенный сканером,
+            # а собранный во время точечного изменения — пропустить это изменение
+            if (cache["track_index"] is None and cache["tracks"] is tracks
+                    and cache.get("generation", 0) == generation):
+                cache["track_index"] = index
+    return index
+
+def _get_tracks(ids: list) -> list:
+    if _use_sqlite():
+        return _db_get_tracks(ids)
+    tracks = _cache["tracks"]
+    found = (tracks[i] for i in ids if i < len(tracks))
+    return [t for t in found if t is not None]
+
+def _track_candidates(query: str, limit: int = _TRACK_CANDIDATES) -> list:
+    """Id треков, набравших больше всего общих n-грамм с запросом."""
+    if _use_sqlite():
+        return _db_track_candidates(query, limit)
+    return _ngram_candidates(_get_track_index(), query, limit)
+
+def _has_tracks() -> bool:
+    if _use_sqlite():
+        return _db_has_tracks()
+    return _get_track_index()["count"] > 0
+
+def _get_artist_exact(index: dict) -> dict:
+    """Фонетика → позиция первого артиста с ней; пересобирается вместе с индексом артистов."""
+    cached = _cache.get("artist_exact")
+    if cached is None or cached[0] is not index:
+        exact = {}
+        for pos, phonetic in enumerate(index["phonetic"]):
+            exact.setdefault(phonetic, pos)
+        cached = (index, exact)
+        _cache["artist_exact"] = cached
+    return cached[1]
+
+def _get_artist_grams(index: dict) -> dict:
+    """Триграммы фонетики артистов; пересобираются, когда подменяется сам индекс артистов."""
+    cached = _cache.get("artist_grams")
+    if cached is None or cached[0] is not index:
+        # Без выравнивания пробелами: partial_ratio ищет имя внутри фразы, а не по границам слов
+        cached = (index, _build_ngram_index(enumerate(index["phonetic"]), pad=False))
+        _cache["artist_grams"] = cached
+    return cached[1]
+
+def _artist_candidates(index: dict, query: str, limit: int = _ARTIST_CANDIDATES) -> list:
+    """
+    Позиции артистов из триграммного индекса для оценки rapidfuzz. Позиции отсортированы,
+    поэтому при равных оценках выигрывает тот же артист, что и при полном переборе.
+    """
+    return sorted(_ngram_candidates(
+        _get_artist_grams(index), query, limit, normalize=True, max_share=_ARTIST_NGRAM_MAX_SHARE
+    ))
+
+def _load_manifest() -> dict:
+    if _use_sqlite():
+        return _db_load_manifest()
+    return _load_manifest_json()
+
+def _load_manifest_json() -> dict:
+    """
+    Манифест вместе с журналом наблюдателя. У каждой записи есть "id" — позиция трека в кэше;
+    в манифесте после полного сканирования его нет, id = порядковый номер записи.
+    """
+    try:
+        with open(_manifest_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        manifest = data if isinstance(data, dict) else {}
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    for n, entry in enumerate(manifest.values()):
+        entry.setdefault("id", n)
+    for path, entry in _read_journal():
+        if entry is None:
+            manifest.pop(path, None)
+        else:
+            manifest[path] = entry
+    return manifest
+
+def _read_journal() -> list:
+    try:
+        with open(_journal_file, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    ops = []
+    for line in lines:
+        try:
+            op = json.loads(line)
+        except ValueError:
+            break  # строка, недописанная при сбое, — последняя
+        ops.append((op["path"], op.get("entry")))
+    return ops
+
+def _append_journal(ops: list):
+    global _journal_ops
+    with open(_journal_file, "a", encoding="utf-8") as f:
+        for path, entry in ops:
+            f.write(json.dumps({"path": path, "entry": entry}, ensure_ascii=False) + "\n")
+    _journal_ops += len(ops)
+
+def _clear_journal():
+    global _journal_ops
+    try:
+        os.remove(_journal_file)
+    except FileNotFoundError:
+        pass
+    _journal_ops = 0
+
+def _save_manifest(manifest: dict):
+    # Пишем во временный файл и подменяем — прерванное сохранение не портит манифест
+    tmp = _manifest_file + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, _manifest_file)
+
 def _is_pure_artist(artist: str) -> bool:
     return not any(x in artist for x in ["feat.", "ft.", "/", "&", " x ", " and ", " с "])
 
+def _thread_bytes_read() -> int:
+    """Сколько байт прочитал текущий поток (rchar из /proc, учитывает и сетевые ФС)."""
+    try:
+        with open("/proc/thread-self/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"rchar:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def _extract_batch(paths: list):
+    # Функция верхнего уровня — её можно передать и в процессный пул
+    before = _thread_bytes_read()
+    tags = [extract_tags(p) for p in paths]
+    return tags, _thread_bytes_read() - before
+
+def _scan_executor(pool_type: str, workers: int):
+    # Пулы нужны только сканеру — не тянем concurrent.futures/multiprocessing при импорте плагина
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    if pool_type == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="music_scan")
+
+def _extract_tags_parallel(paths: list, on_batch=None) -> dict:
+    """
+    Читает теги пачками в пуле воркеров. Возвращает {путь: (artist, title)}.
+    on_batch(пачка путей, прочитано байт) вызывается по мере готовности пачек — для прогресса.
+    """
+    if not paths:
+        return {}
+    from concurrent.futures import BrokenExecutor
+    workers = int(config.get("scan_workers") or 0) or (os.cpu_count() or 1)
+    batch_size = max(1, int(config.get("scan_batch_size") or 1))
+    pool_type = config.get("scan_pool", "thread")
+
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    results = []
+
+    def collect(batch_results):
+        # map сохраняет порядок пачек — результат детерминирован
+        for tags, nbytes in batch_results:
+            batch = batches[len(results) // batch_size]
+            results.extend(tags)
+            if on_batch:
+                on_batch(batch, nbytes)
+
+    if workers <= 1:
+        collect(map(_extract_batch, batches))
+        return dict(zip(paths, results))
+
+    try:
+        with _scan_executor(pool_type, workers) as pool:
+            collect(pool.map(_extract_batch, batches))
+    except (BrokenExecutor, OSError, PicklingError) as e:
+        if pool_type != "process":
+            raise
+        # Процессы недоступны (нет fork/spawn, плагин не импортируется по имени) — дочитываем в потоках
+        print(f"[MusicSearch] Процессный пул недоступен ({e}), переключаюсь на потоки")
+        with _scan_executor("thread", workers) as pool:
+            collect(pool.map(_extract_batch, batches[len(results) // batch_size:]))
+    return dict(zip(paths, results))
+
+def _manifest_entry(filepath: str, size: int, mtime: float, tags) -> dict:
+    artist, title = tags
+    if not artist:
+        artist = os.path.basename(os.path.dirname(filepath))
+    if not title:
+        title = Path(filepath).stem
+    return {"size": size, "mtime": mtime, "artist": artist, "title": title}
+
+def _derive_library(manifest: dict):
+    """
+    Чистые артисты и треки из манифеста. Позиция трека — "id" записи,
+    а без него (после полного сканирования) — порядок записей манифеста.
+    """
+    pure_artists = set()
+    tracks = _TrackTable()
+    for n, entry in enumerate(manifest.values()):
+        artist, title = entry.get("artist", ""), entry.get("title", "")
+        if artist and _is_pure_artist(artist):
+            pure_artists.add(artist)
+        tracks.set(entry.get("id", n), artist, title)
+    return pure_artists, tracks
+
+def _commit_library(manifest: dict, pure_artists: set, tracks: _TrackTable):
+    """Строит индексы, подменяет кэш и сохраняет его вместе с манифестом."""
+    global _files
+    artist_index = _build_artist_index(pure_artists, _cache["artist_index"])
+    if _use_sqlite():
+        # Треки, манифест и триграммы — в базе; в памяти держим только индекс артистов
+        _db_save(manifest, tracks, artist_index)
+        with _scan_lock:
+            _cache["pure_artists"] = pure_artists
+            _cache["tracks"] = _TrackTable()
+            _cache["artist_index"] = artist_index
+            _cache["track_index"] = None
+        return
+
+    # Журнал ссылается на прежнюю нумерацию треков — удаляем его до записи нового манифеста
+    _clear_journal()
+    track_index = _build_ngram_index(enumerate(tracks.iter_search_ru()))
+    with _scan_lock:
+        _cache["pure_artists"] = pure_artists
+        _cache["tracks"] = tracks
+        _cache["artist_index"] = artist_index
+        _cache["track_index"] = track_index
+        _cache["artist_refs"] = None
+        _save_cache()
+        _save_manifest(manifest)
+    if _files is not None:
+        _files = {path: (e["size"], e["mtime"], i) for i, (path, e) in enumerate(manifest.items())}
+
+# === Точечные изменения библиотеки (наблюдатель за папкой) ===
+def _get_files() -> dict:
+    """Манифест в памяти (режим json); читается с диска при первом изменении."""
+    global _files
+    if _files is None:
+        _files = {path: (e["size"], e["mtime"], e["id"]) for path, e in _load_manifest_json().items()}
+    return _files
+
+def _manifest_paths(path: str, recursive: bool = True) -> list:
+    """Известные манифесту файлы внутри пути; recursive=False — только на верхнем уровне папки."""
+    if _use_sqlite():
+        known = _db_manifest_paths(path)
+    else:
+        prefix = path.rstrip(os.sep) + os.sep
+        known = [p for p in _get_files() if p == path or p.startswith(prefix)]
+    if not recursive:
+        known = [p for p in known if os.path.dirname(p) == path]
+    return known
+
+def _manifest_lookup(paths: list) -> dict:
+    """Путь → (размер, mtime) из манифеста для известных ему путей."""
+    if _use_sqlite():
+        return _db_manifest_lookup(paths)
+    files = _get_files()
+    return {p: files[p][:2] for p in paths if p in files}
+
+def _artist_refs() -> Counter:
+    """Число треков у чистых артистов — по нему видно, когда артист пропадает из индекса."""
+    refs = _cache.get("artist_refs")
+    if refs is None:
+        refs = Counter({a: n for a, n in _cache["tracks"].artist_counts().items() if a and _is_pure_artist(a)})
+        _cache["artist_refs"] = refs
+    return refs
+
+def _update_artist_index(index: dict, added: set, removed: set) -> dict:
+    """Новый индекс артистов с точечными изменениями; старый не трогаем — его читают обработчики."""
+    artists = list(index["artists"])
+    phonetic = list(index["phonetic"])
+    for artist in removed:
+        pos = bisect_left(artists, artist)
+        if pos < len(artists) and artists[pos] == artist:
+            del artists[pos]
+            del phonetic[pos]
+    for artist in added:
+        pos = bisect_left(artists, artist)
+        if pos == len(artists) or artists[pos] != artist:
+            artists.insert(pos, artist)
+            phonetic.insert(pos, eng_to_ru_phonetic(artist))
+    return {"artists": artists, "phonetic": phonetic}
+
+def _update_pure_artists(added: set, removed: set):
+    # Вызывается под _scan_lock; в режиме sqlite до первого запроса индекса в памяти нет
+    index = _cache["artist_index"]
+    if index is None or not (added or removed):
+        return
+    _cache["pure_artists"] = (_cache["pure_artists"] - removed) | added
+    _cache["artist_index"] = _update_artist_index(index, added, removed)
+
+def _json_apply_changes(changes: list):
+    files = _get_files()
+    refs = _artist_refs()
+    touched = set()
+    journal = []
+    with _scan_lock:
+        tracks = _cache["tracks"]
+        track_index = _cache["track_index"]
+        for path, entry in changes:
+            old = files.pop(path, None)
+            track_id = old[2] if old else None
+            track = tracks[track_id] if old and track_id < len(tracks) else None
+            if track is not None:
+                if track_index is not None:
+                    _ngram_remove(track_index, track_id, track["search_ru"])
+                tracks.remove(track_id)
+                artist = track["artist"]
+                touched.add(artist)
+                if artist in refs:
+                    refs[artist] -= 1
+                    if refs[artist] <= 0:
+                        del refs[artist]
+            if entry is None:
+                journal.append((path, None))
+                continue
+            if track_id is None:
+                track_id = tracks.allocate()
+            artist = entry["artist"]
+            tracks.set(track_id, artist, entry["title"])
+            if track_index is not None:
+                _ngram_add(track_index, track_id, tracks.search_ru(track_id))
+            if artist and _is_pure_artist(artist):
+                refs[artist] += 1
+            touched.add(artist)
+            files[path] = (entry["size"], entry["mtime"], track_id)
+            journal.append((path, dict(entry, id=track_id)))
+
+        pure = _cache["pure_artists"]
+        _update_pure_artists(
+            {a for a in touched if a in refs and a not in pure},
+            {a for a in touched if a not in refs and a in pure},
+        )
+        _cache["generation"] = _cache.get("generation", 0) + 1
+
+    _append_journal(journal)
+    if _journal_ops > max(_JOURNAL_COMPACT_MIN, len(_cache["tracks"]) // 10):
+        _compact_json()
+
+def _compact_json():
+    """
+    Сворачивает журнал: кэш и манифест (уже с id треков) переписываются целиком.
+    Позиции удалённых треков при этом уплотняются — в music_cache_v2_7.json пустых записей нет.
+    """
+    global _files
+    tracks = _cache["tracks"]
+    if tracks.free_count():
+        tracks, new_ids = tracks.compacted()
+        # Индекс триграмм ссылается на старые id; если он уже был построен — строим заново сразу
+        track_index = None
+        if _cache["track_index"] is not None:
+            track_index = _build_ngram_index(enumerate(tracks.iter_search_ru()))
+        with _scan_lock:
+            _cache["tracks"] = tracks
+            _cache["track_index"] = track_index
+            _cache["generation"] = _cache.get("generation", 0) + 1
+        _files = {path: (size, mtime, new_ids[i]) for path, (size, mtime, i) in _files.items()
+                  if i < len(new_ids) and new_ids[i] is not None}
+    manifest = {}
+    for path, (size, mtime, track_id) in _files.items():
+        track = tracks[track_id]
+        if track is None:
+            continue
+        manifest[path] = {"size": size, "mtime": mtime, "artist": track["artist"], "title": track["title"],
+                          "id": track_id}
+    _save_cache()
+    _save_manifest(manifest)
+    _clear_journal()
+
+def _apply_file_changes(changes: list):
+    """
+    Применяет изменения файлов: пары (путь, запись манифеста или None — файл удалён).
+    Меняются только затронутые треки, их n-граммы и артисты; вызывается под _library_lock.
+    """
+    if _use_sqlite():
+        added, removed = _db_apply_changes(changes)
+        with _scan_lock:
+            _update_pure_artists(added, removed)
+            _cache["generation"] = _cache.get("generation", 0) + 1
+    else:
+        _json_apply_changes(changes)
+    index = _cache["artist_index"]
+    if index is not None:
+        # Вспомогательные индексы нового индекса артистов строим здесь, а не в первой команде
+        _get_artist_exact(index)
+        if len(index["phonetic"]) > _ARTIST_PREFILTER_MIN:
+            _get_artist_grams(index)
+
+# === Прогресс сканирования ===
+_status_file = "music_scan_status.json"
+_STATUS_WRITE_INTERVAL = 1.0
+_PHASE_NAMES = {
+    "walk": "обход папок",
+    "parse": "чтение тегов",
+    "save": "сохранение кэша",
+    "done": "завершено",
+    "error": "ошибка",
+}
+_scan_progress = {}
+_progress_lock = threading.Lock()
+_status_written_at = 0.0
+
+def _progress_reset(folder: str):
+    with _progress_lock:
+        _scan_progress.clear()
+        _scan_progress.update({
+            "phase": "walk",
+            "folder": folder,
+            "current_dir": folder,
+            "files_discovered": 0,
+            "files_to_parse": 0,
+            "files_parsed": 0,
+            "bytes_read": 0,
+            "started_at": time.time(),
+            "parse_started_at": None,
+            "finished_at": None,
+        })
+    _write_status_file(force=True)
+
+def _progress_update(force: bool = False, **fields):
+    with _progress_lock:
+        for key, value in fields.items():
+            if key in ("files_discovered", "files_parsed", "bytes_read"):
+                _scan_progress[key] = _scan_progress.get(key, 0) + value
+            else:
+                _scan_progress[key] = value
+    _write_status_file(force=force)
+
+def _progress_snapshot() -> dict:
+    """Копия счётчиков + вычисленные скорость (файлов/с) и ETA (с)."""
+    with _progress_lock:
+        snap = dict(_scan_progress)
+    if not snap:
+        return snap
+    now = snap.get("finished_at") or time.time()
+    snap["elapsed"] = round(now - snap["started_at"], 1)
+    rate = 0.0
+    eta = None
+    if snap.get("parse_started_at"):
+        parse_elapsed = now - snap["parse_started_at"]
+        if parse_elapsed > 0:
+            rate = snap["files_parsed"] / parse_elapsed
+        if rate > 0 and snap["phase"] == "parse":
+            eta = (snap["files_to_parse"] - snap["files_parsed"]) / rate
+    snap["files_per_sec"] = round(rate, 1)
+    snap["eta_sec"] = round(eta) if eta is not None else None
+    return snap
+
+def _write_status_file(force: bool = False):
+    """Пишет прогресс в JSON не чаще раза в секунду (атомарно, через временный файл)."""
+    global _status_written_at
+    now = time.monotonic()
+    if not force and now - _status_written_at < _STATUS_WRITE_INTERVAL:
+        return
+    _status_written_at = now
+    try:
+        tmp = _status_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_progress_snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, _status_file)
+    except OSError as e:
+        print(f"[MusicSearch] Не удалось записать статус сканирования: {e}")
+
+def _scan_library(folder: str) -> dict:
+    """Полное (инкрементальное по манифесту) сканирование папки. Возвращает счётчики."""
+    with _library_lock:
+        old_manifest = _load_manifest()
+        manifest = {}
+        reused = 0
+
+        # 1. Обход папки: порядок файлов фиксирован и задаёт порядок треков в кэше
+        files_found = []
+        for root, _, files in os.walk(folder):
+            found_before = len(files_found)
+            for file in files:
+                if Path(file).suffix.lower() in SUPPORTED_EXTENSIONS:
+                    filepath = os.path.join(root, file)
+                    try:
+                        st = os.stat(filepath)
+                    except OSError:
+                        continue
+                    files_found.append((filepath, st.st_size, st.st_mtime))
+            _progress_update(current_dir=root, files_discovered=len(files_found) - found_before)
+
+        # 2. Теги читаем только у новых и изменённых файлов — пулом воркеров
+        to_parse = []
+        for filepath, size, mtime in files_found:
+            entry = old_manifest.get(filepath)
+            if not (entry and entry.get("size") == size and entry.get("mtime") == mtime):
+                to_parse.append(filepath)
+        _progress_update(force=True, phase="parse", files_to_parse=len(to_parse), parse_started_at=time.time())
+        parsed = _extract_tags_parallel(
+            to_parse,
+            on_batch=lambda batch, nbytes: _progress_update(
+                current_dir=os.path.dirname(batch[-1]), files_parsed=len(batch), bytes_read=nbytes
+            )
+        )
+        _progress_update(force=True, phase="save")
+
+        # 3. Слияние в исходном порядке обхода
+        for filepath, size, mtime in files_found:
+            if filepath in parsed:
+                manifest[filepath] = _manifest_entry(filepath, size, mtime, parsed[filepath])
+            else:
+                # Файл не менялся — берём теги из манифеста без парсинга (позиции треков назначатся заново)
+                entry = dict(old_manifest[filepath])
+                entry.pop("id", None)
+                manifest[filepath] = entry
+                reused += 1
+        removed = [path for path in old_manifest if path not in manifest]
+
+        if _use_sqlite() and old_manifest:
+            # База уже заполнена — переписываем только строки новых, изменённых и удалённых файлов
+            changes = [(path, None) for path in removed] + [(path, manifest[path]) for path in parsed]
+            if changes:
+                _apply_file_changes(changes)
+            artist_count = len(_get_artist_index()["artists"])
+        else:
+            pure_artists, tracks = _derive_library(manifest)
+            _commit_library(manifest, pure_artists, tracks)
+            artist_count = len(pure_artists)
+
+    return {
+        "total": len(files_found),
+        "reused": reused,
+        "updated": len(to_parse),
+        "removed": len(removed),
+        "artists": artist_count,
+    }
+
 def _scan_worker(va_interface):
     """Фоновый сканер с уведомлением о завершении"""
     global _scan_in_progress
@@ -126,51 +1567,31 @@ def _scan_worker(va_interface):
             va_interface.say("Папка с музыкой не настроена или не существует.")
             return
 
-        pure_artists = set()
-        tracks = []
-        total_files = 0
-
-        for root, _, files in os.walk(folder):
-            for file in files:
-                if Path(file).suffix.lower() in SUPPORTED_EXTENSIONS:
-                    total_files += 1
-                    filepath = os.path.join(root, file)
-                    artist, title = extract_tags(filepath)
-                    if not artist:
-                        artist = os.path.basename(root)
-                    if not title:
-                        title = Path(file).stem
-
-                    if artist and _is_pure_artist(artist):
-                        pure_artists.add(artist)
-
-                    tracks.append({
-                        "artist": artist,
-                        "title": title,
-                        "search_name": f"{artist} - {title}",
-                        "search_ru": eng_to_ru_phonetic(f"{artist} - {title}")
-                    })
-
-        # Сохраняем результат
-        with _scan_lock:
-            _cache["pure_artists"] = pure_artists
-            _cache["tracks"] = tracks
-            _save_cache()
+        # Сканер подменяет кэш — старый не должен догрузиться поверх нового
+        _cache_ready.wait()
+        _ensure_cache_current()
+        _progress_reset(folder)
+        stats = _scan_library(folder)
+        _progress_update(force=True, phase="done", finished_at=time.time())
 
         # Уведомляем об успешном завершении
         va_interface.say(
             f"Сканирование музыки завершено. "
-            f"Обработано файлов: {total_files}. "
-            f"Чистых артистов найдено: {len(pure_artists)}."
+            f"Обработано файлов: {stats['total']}. "
+            f"Без изменений: {stats['reused']}, обновлено: {stats['updated']}, удалено: {stats['removed']}. "
+            f"Чистых артистов найдено: {stats['artists']}."
         )
 
     except Exception as e:
+        if _scan_progress:
+            _progress_update(force=True, phase="error", error=str(e)[:200], finished_at=time.time())
         try:
             va_interface.say(f"Ошибка при сканировании: {str(e)[:100]}")
         except:
             pass
     finally:
         _scan_in_progress = False
+        _start_watcher()
 
 def handle_scan_music(va, phrase=None):
     global _scan_thread, _scan_in_progress
@@ -193,22 +1614,382 @@ def handle_scan_music(va, phrase=None):
     )
     _scan_thread.start()
 
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
 def handle_scan_status(va, phrase=None):
     if _scan_in_progress:
-        va.say("Сканирование музыки ещё выполняется. Пожалуйста, подождите.")
+        progress = _progress_snapshot()
+        if not progress:
+            va.say("Сканирование музыки ещё выполняется. Пожалуйста, подождите.")
+            return
+        parts = [f"Сканирование музыки выполняется, этап: {_PHASE_NAMES.get(progress['phase'], progress['phase'])}."]
+        if progress["phase"] == "walk":
+            parts.append(f"Найдено файлов: {progress['files_discovered']}.")
+        elif progress["phase"] == "parse":
+            parts.append(f"Прочитано {progress['files_parsed']} из {progress['files_to_parse']} файлов.")
+            parts.append(f"Скорость: {progress['files_per_sec']} файлов в секунду.")
+            parts.append(f"Считано с диска {progress['bytes_read'] / (1024 * 1024):.1f} мегабайт.")
+            if progress["eta_sec"] is not None:
+                parts.append(f"Осталось примерно {_format_duration(progress['eta_sec'])}.")
+        parts.append(f"Текущая папка: {os.path.basename(progress['current_dir']) or progress['current_dir']}.")
+        va.say(" ".join(parts))
     else:
-        artist_count = len(_cache["pure_artists"])
+        if not _wait_cache_ready(va):
+            return
+        artist_count = len(_get_artist_index()["artists"])
         if artist_count == 0:
             va.say("Музыка не просканирована или не найдено чистых артистов.")
         else:
             va.say(f"Сканирование завершено. Найдено чистых артистов: {artist_count}.")
 
-def _play_via_ha(media_id: str, media_type: str, radio_mode: bool = False):
+# === Наблюдение за папкой: обновление кэша без полного пересканирования ===
+_watch_thread = None
+_watch_stop = None
+_watch_params = None
+_watch_lock = threading.Lock()
+
+def _is_music_file(path: str) -> bool:
+    return Path(path).suffix.lower() in SUPPORTED_EXTENSIONS
+
+def _apply_path_changes(paths, recursive: bool = True) -> dict:
+    """
+    Обновляет манифест и кэш только для затронутых путей.
+    Путь может быть файлом или папкой; исчезнувшие пути удаляются из манифеста вместе с содержимым.
+    recursive=False — папка сверяется только на своём уровне (так работает опрос).
+    """
+    with _library_lock:
+        files = set()
+        gone = set()
+        for path in sorted(paths):
+            if os.path.isdir(path):
+                present = set()
+                if recursive:
+                    for root, _, names in os.walk(path):
+                        present.update(os.path.join(root, n) for n in names)
+                else:
+                    try:
+                        present = {e.path for e in os.scandir(path) if e.is_file()}
+                    except OSError:
+                        present = set()
+                gone.update(p for p in _manifest_paths(path, recursive) if p not in present)
+                files.update(present)
+            elif os.path.exists(path):
+                files.add(path)
+            else:
+                gone.update(_manifest_paths(path))
+
+        files = sorted(f for f in files if _is_music_file(f))
+        known = _manifest_lookup(files)
+        to_parse = []
+        for filepath in files:
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                if filepath in known:
+                    gone.add(filepath)
+                continue
+            if known.get(filepath) == (st.st_size, st.st_mtime):
+                continue
+            to_parse.append((filepath, st.st_size, st.st_mtime))
+
+        parsed = _extract_tags_parallel([f for f, _, _ in to_parse])
+        changes = [(path, None) for path in sorted(gone)]
+        changes += [(f, _manifest_entry(f, size, mtime, parsed[f])) for f, size, mtime in to_parse]
+        if changes:
+            _apply_file_changes(changes)
+
+    return {"updated": len(to_parse), "removed": len(gone)}
+
+def _flush_changes(paths: set, recursive: bool = True) -> bool:
+    """Применяет накопленные изменения. Во время полного сканирования откладывает их."""
+    if _scan_in_progress:
+        return False
+    try:
+        _ensure_cache_current()
+        stats = _apply_path_changes(paths, recursive)
+        if stats["updated"] or stats["removed"]:
+            print(f"[MusicSearch] Наблюдатель: обновлено {stats['updated']}, удалено {stats['removed']}")
+    except Exception as e:
+        print(f"[MusicSearch] Ошибка обновления по событиям папки: {e}")
+    return True
+
+def _watch_inotify(folder: str, stop: threading.Event):
+    from inotify_simple import INotify, flags
+
+    debounce = float(config.get("watch_debounce", 3.0))
+    # Если события идут непрерывно (копируется большая коллекция) — всё равно сбрасываем раз в max_wait
+    max_wait = debounce * 10
+    mask = (flags.CREATE | flags.DELETE | flags.CLOSE_WRITE
+            | flags.MOVED_FROM | flags.MOVED_TO | flags.DELETE_SELF)
+    inotify = INotify()
+    watches = {}
+
+    def add_tree(top):
+        for root, _, _ in os.walk(top):
+            try:
+                # Для уже наблюдаемой (перемещённой) папки ядро вернёт тот же wd — путь обновится
+                watches[inotify.add_watch(root, mask)] = root
+            except OSError:
+                pass
+
+    # Теги читаются в отдельном потоке: пока он занят, читатель продолжает выбирать события,
+    # и очередь ядра (max_queued_events) не переполняется
+    batches = queue.Queue()
+
+    def flusher():
+        while True:
+            paths = batches.get()
+            if paths is None:
+                return
+            # Во время полного сканирования изменения откладываются
+            while not _flush_changes(paths) and not stop.wait(1.0):
+                pass
+
+    threading.Thread(target=flusher, daemon=True, name="music_watch_flush").start()
+    add_tree(folder)
+    pending = set()
+    first_event = last_event = 0.0
+    try:
+        while not stop.is_set():
+            events = inotify.read(timeout=500)
+            for event in events:
+                if event.mask & flags.Q_OVERFLOW:
+                    # Ядро потеряло часть событий (wd = -1) — сверяем с манифестом всю папку
+                    print("[MusicSearch] Переполнена очередь inotify, сверяю всю папку с манифестом")
+                    add_tree(folder)
+                    pending.add(folder)
+                    continue
+                if event.mask & flags.IGNORED:
+                    watches.pop(event.wd, None)
+                    continue
+                base = watches.get(event.wd)
+                if base is None or not event.name:
+                    continue
+                path = os.path.join(base, event.name)
+                if event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+                    add_tree(path)
+                pending.add(path)
+            if events:
+                last_event = time.monotonic()
+                first_event = first_event or last_event
+
+            now = time.monotonic()
+            if pending and (now - last_event >= debounce or now - first_event >= max_wait):
+                batches.put(pending)
+                pending = set()
+                first_event = 0.0
+    finally:
+        batches.put(None)
+        inotify.close()
+
+def _snapshot_dirs(folder: str):
+    """mtime каталогов и список музыкальных файлов в них."""
+    snapshot = {}
+    music = []
+    for root, _, names in os.walk(folder):
+        try:
+            snapshot[root] = os.stat(root).st_mtime
+        except OSError:
+            pass
+        music.extend(os.path.join(root, n) for n in names if _is_music_file(n))
+    return snapshot, music
+
+def _stale_files(paths: list) -> list:
+    """Файлы, у которых размер или mtime расходятся с манифестом (или которых в нём нет)."""
+    with _library_lock:
+        known = _manifest_lookup(paths)
+    stale = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            stale.append(path)
+            continue
+        if known.get(path) != (st.st_size, st.st_mtime):
+            stale.append(path)
+    return stale
+
+def _watch_poll(folder: str, stop: threading.Event):
+    """
+    Для сетевых папок, где inotify не работает. Сравнивает mtime каталогов:
+    он меняется при добавлении, удалении и переименовании файлов. Файлы читаются
+    только в изменившихся каталогах. Перезапись файла на месте (например, новые теги)
+    mtime каталога не меняет, поэтому каждый опрос ещё сверяет с манифестом очередную
+    часть файлов — вся библиотека проходит за watch_poll_file_check секунд.
+    """
+    interval = float(config.get("watch_poll_interval", 60))
+    check_period = float(config.get("watch_poll_file_check", 600))
+    dirs, _ = _snapshot_dirs(folder)
+    cursor = 0
+    pending = set()
+    while not stop.wait(interval):
+        current, music = _snapshot_dirs(folder)
+        pending.update(d for d, mtime in current.items() if dirs.get(d) != mtime)
+        pending.update(d for d in dirs if d not in current)
+        dirs = current
+        if music and check_period > 0 and not _scan_in_progress:
+            count = len(music) if check_period <= interval else max(1, int(len(music) * interval / check_period))
+            cursor %= len(music)
+            batch = music[cursor:cursor + count] + music[:max(0, cursor + count - len(music))]
+            cursor += count
+            pending.update(_stale_files(batch))
+        if pending and _flush_changes(pending, recursive=False):
+            pending = set()
+
+def _watch_loop(watcher, folder: str, stop: threading.Event):
+    try:
+        watcher(folder, stop)
+    except Exception as e:
+        print(f"[MusicSearch] Наблюдатель за папкой остановлен: {e}")
+
+def _start_watcher():
+    """
+    Запускает наблюдатель: при загрузке, после сканирования и из команд. Если в настройках
+    сменились папка или режим, прежний наблюдатель останавливается и запускается новый.
+    """
+    global _watch_thread, _watch_stop, _watch_params
+    mode = config.get("watch_mode", "off")
+    folder = config.get("music_folder", "").strip()
+    with _watch_lock:
+        running = _watch_thread is not None and _watch_thread.is_alive()
+        if running and _watch_params == (mode, folder):
+            return
+        if running:
+            print("[MusicSearch] Настройки наблюдения изменились, останавливаю прежний наблюдатель")
+            _watch_stop.set()
+            _watch_thread = None
+        if mode == "off" or not folder or not os.path.isdir(folder):
+            return
+
+        _watch_params = (mode, folder)
+        if mode in ("auto", "inotify"):
+            try:
+                import inotify_simple  # noqa: F401
+                mode = "inotify"
+            except ImportError:
+                if mode == "inotify":
+                    print("[MusicSearch] inotify_simple не установлен, использую опрос папки")
+                mode = "poll"
+
+        watcher = _watch_inotify if mode == "inotify" else _watch_poll
+        _watch_stop = threading.Event()
+        _watch_thread = threading.Thread(
+            target=_watch_loop,
+            args=(watcher, folder, _watch_stop),
+            daemon=True,
+            name="music_watch"
+        )
+        _watch_thread.start()
+
+# === Очередь запросов к Home Assistant ===
+# Обработчик только ставит запрос в очередь и сразу отвечает голосом;
+# отправляет фоновый поток через одну сессию requests (соединение переиспользуется).
+_ha_status_file = "music_ha_status.json"
+_HA_LATENCY_WINDOW = 100
+_ha_queue = queue.Queue()
+_ha_thread = None
+_ha_lock = threading.Lock()
+_ha_metrics = {"sent": 0, "failed": 0, "superseded": 0, "last_error": "", "last_request_at": None}
+_ha_latencies = deque(maxlen=_HA_LATENCY_WINDOW)   # длительность запроса, сек
+_ha_waits = deque(maxlen=_HA_LATENCY_WINDOW)       # время в очереди, сек
+
+def _ha_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _percentile_ms(samples: list, share: float):
+    if not samples:
+        return None
+    return round(samples[min(len(samples) - 1, int(len(samples) * share))] * 1000, 1)
+
+def _ha_metrics_snapshot() -> dict:
+    """Счётчики, глубина очереди и задержки (p50/p95 по последним запросам)."""
+    with _ha_lock:
+        snapshot = dict(_ha_metrics)
+        latencies = sorted(_ha_latencies)
+        waits = sorted(_ha_waits)
+    snapshot.update({
+        "queue_depth": _ha_queue.qsize(),
+        "latency_p50_ms": _percentile_ms(latencies, 0.5),
+        "latency_p95_ms": _percentile_ms(latencies, 0.95),
+        "queue_wait_p50_ms": _percentile_ms(waits, 0.5),
+        "queue_wait_p95_ms": _percentile_ms(waits, 0.95),
+    })
+    return snapshot
+
+def _write_ha_status():
+    try:
+        tmp = _ha_status_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_ha_metrics_snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, _ha_status_file)
+    except OSError as e:
+        print(f"[MusicSearch] Не удалось записать статус Home Assistant: {e}")
+
+def _ha_send(session, payload: dict):
     url = config["ha_url"].rstrip("/") + "/api/services/media_player/play_media"
     headers = {
         "Authorization": f"Bearer {config['ha_token']}",
         "Content-Type": "application/json"
     }
+    response = session.post(url, json=payload, headers=headers, timeout=float(config.get("ha_timeout", 10)))
+    response.raise_for_status()
+
+def _ha_worker():
+    session = _ha_session()
+    while True:
+        item = _ha_queue.get()
+        # Пока шёл прошлый запрос, могли попросить включить что-то ещё — играть должно последнее
+        superseded = 0
+        while True:
+            try:
+                item = _ha_queue.get_nowait()
+                superseded += 1
+            except queue.Empty:
+                break
+        va, payload, enqueued_at = item
+
+        started = time.monotonic()
+        error = None
+        try:
+            _ha_send(session, payload)
+        except Exception as e:
+            error = e
+        finished = time.monotonic()
+
+        with _ha_lock:
+            _ha_latencies.append(finished - started)
+            _ha_waits.append(started - enqueued_at)
+            _ha_metrics["superseded"] += superseded
+            _ha_metrics["sent"] += 1
+            _ha_metrics["last_request_at"] = time.time()
+            if error is not None:
+                _ha_metrics["failed"] += 1
+                _ha_metrics["last_error"] = str(error)[:200]
+        _write_ha_status()
+
+        if error is not None:
+            print(f"[MusicSearch] Ошибка запроса к Home Assistant: {error}")
+            if va is not None:
+                try:
+                    va.say(f"Home Assistant не смог включить {payload['media_content_id']}.")
+                except Exception:
+                    pass
+
+def _play_via_ha(media_id: str, media_type: str, radio_mode: bool = False, va=None):
+    """Ставит воспроизведение в очередь и сразу возвращается. Об ошибке скажет через va."""
+    global _ha_thread
     payload = {
         "entity_id": config["ha_entity_id"],
         "media_content_type": media_type,
@@ -218,30 +1999,62 @@ def _play_via_ha(media_id: str, media_type: str, radio_mode: bool = False):
             "dont_stop_the_music": radio_mode
         }
     }
-    try:
-        requests.post(url, json=payload, headers=headers, timeout=10)
-    except Exception:
-        pass
+    with _ha_lock:
+        if _ha_thread is None or not _ha_thread.is_alive():
+            _ha_thread = threading.Thread(target=_ha_worker, daemon=True, name="music_ha")
+            _ha_thread.start()
+    _ha_queue.put((va, payload, time.monotonic()))
+
+def _match_artist(phrase: str):
+    """Ищет артиста по предпосчитанному фонетическому индексу. Возвращает имя или None."""
+    from rapidfuzz import process, fuzz
+    min_score = config.get("min_similarity", 85)
+
+    index = _get_artist_index()
+    query = phrase.lower()
+    phonetic = index["phonetic"]
+    # Точное совпадение фонетики — сразу, при любом размере библиотеки: иначе partial_ratio
+    # с той же оценкой 100 мог бы выбрать раньше стоящее имя, которое лишь входит в запрос
+    pos = _get_artist_exact(index).get(query.strip())
+    if pos is not None:
+        return index["artists"][pos]
+    if len(phonetic) > _ARTIST_PREFILTER_MIN:
+        positions = _artist_candidates(index, query)
+        result = process.extractOne(query, [phonetic[i] for i in positions], scorer=fuzz.partial_ratio)
+        if result and result[1] >= min_score:
+            return index["artists"][positions[result[2]]]
+        # Триграммы могли не отобрать нужного артиста — перед ответом «не найден» проверяем всех
+
+    result = process.extractOne(query, phonetic, scorer=fuzz.partial_ratio)
+    if result and result[1] >= min_score:
+        return index["artists"][result[2]]
+    return None
+
+def _wait_cache_ready(va) -> bool:
+    """Ждёт фоновую загрузку кэша не дольше load_timeout секунд."""
+    if _cache_ready.wait(float(config.get("load_timeout", 10))):
+        # Хранилище, папку или режим наблюдения могли поменять в настройках уже после запуска
+        _ensure_cache_current()
+        _start_watcher()
+        return True
+    va.say("База музыки ещё загружается, повторите через несколько секунд.")
+    return False
 
 def handle_find_artist(va, phrase):
     if not config.get("enabled"):
         return
     if config.get("use_intro_phrases"):
         va.say("Ищу артиста...")
+    if not _wait_cache_ready(va):
+        return
 
-    from rapidfuzz import process, fuzz
-    min_score = config.get("min_similarity", 85)
-
-    if not _cache["pure_artists"]:
+    if not _get_artist_index()["artists"]:
         va.say("Музыка не просканирована.")
         return
 
-    choices = [eng_to_ru_phonetic(a) for a in _cache["pure_artists"]]
-    result = process.extractOne(phrase.lower(), choices, scorer=fuzz.partial_ratio)
-
-    if result and result[1] >= min_score:
-        artist = list(_cache["pure_artists"])[result[2]]
-        _play_via_ha(artist, "artist", radio_mode=False)
+    artist = _match_artist(phrase)
+    if artist:
+        _play_via_ha(artist, "artist", radio_mode=False, va=va)
         va.say(f"Включаю артиста {artist}.")
         return
 
@@ -252,32 +2065,98 @@ def handle_radio_artist(va, phrase):
         return
     if config.get("use_intro_phrases"):
         va.say("Запускаю радио...")
+    if not _wait_cache_ready(va):
+        return
 
+    if not _get_artist_index()["artists"]:
+        va.say("Музыка не просканирована.")
+        return
+
+    artist = _match_artist(phrase)
+    if artist:
+        _play_via_ha(artist, "artist", radio_mode=True, va=va)
+        va.say(f"Запускаю радио по артисту {artist}.")
+        return
+
+    va.say("Артист для радио не найден.")
+
+def _match_track(phrase: str):
+    """Сужает поиск по n-граммам и только кандидатов оценивает через rapidfuzz."""
     from rapidfuzz import process, fuzz
     min_score = config.get("min_similarity", 85)
 
-    if not _cache["pure_artists"]:
-        va.say("Музыка не просканирована.")
+    query = eng_to_ru_phonetic(phrase)
+    candidates = _get_tracks(_track_candidates(query))
+    if not candidates:
+        return None
+    result = process.extractOne(query, [t["search_ru"] for t in candidates], scorer=fuzz.WRatio)
+    if result and result[1] >= min_score:
+        return candidates[result[2]]
+    return None
+
+def handle_play_track(va, phrase):
+    if not config.get("enabled"):
+        return
+    if config.get("use_intro_phrases"):
+        va.say("Ищу песню...")
+    if not _wait_cache_ready(va):
         return
 
-    choices = [eng_to_ru_phonetic(a) for a in _cache["pure_artists"]]
-    result = process.extractOne(phrase.lower(), choices, scorer=fuzz.partial_ratio)
+    if not _has_tracks():
+        va.say("Музыка не просканирована.")
+        return
 
-    if result and result[1] >= min_score:
-        artist = list(_cache["pure_artists"])[result[2]]
-        _play_via_ha(artist, "artist", radio_mode=True)
-        va.say(f"Запускаю радио по артисту {artist}.")
+    track = _match_track(phrase)
+    if track:
+        _play_via_ha(track["search_name"], "track", radio_mode=False, va=va)
+        va.say(f"Включаю песню {track['title']}, исполнитель {track['artist']}.")
         return
 
-    va.say("Артист для радио не найден.")
+    va.say("Песня не найдена.")
 
 # === Команды ===
 define_commands = {
     "найди артиста": handle_find_artist,
     "включи радио": handle_radio_artist,
+    "включи песню": handle_play_track,
     "просканируй музыку": handle_scan_music,
     "статус сканирования": handle_scan_status,
 }
 
 # === Загрузка ===
-_load_cache()
+# Импортируются заранее, чтобы первая команда не ждала загрузки библиотек
+_WARM_MODULES = (
+    "rapidfuzz.process", "rapidfuzz.fuzz", "requests",
+    "mutagen.easyid3", "mutagen.mp3", "mutagen.flac", "mutagen.easymp4", "mutagen.oggvorbis", "mutagen.wave",
+)
+
+def _warm_up():
+    """Библиотеки и ленивые индексы — пока Ирина ещё ни о чём не спросила."""
+    for module in _WARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    index = _get_artist_index()
+    _get_artist_exact(index)
+    if len(index["phonetic"]) > _ARTIST_PREFILTER_MIN:
+        _get_artist_grams(index)
+    if not _use_sqlite():
+        _get_track_index()
+
+def _background_load():
+    started = time.perf_counter()
+    try:
+        _load_cache()
+    except Exception as e:
+        print(f"[MusicSearch] Ошибка загрузки кэша: {e}")
+    finally:
+        _cache_ready.set()
+    _start_watcher()
+    try:
+        _warm_up()
+    except Exception as e:
+        print(f"[MusicSearch] Ошибка прогрева: {e}")
+    print(f"[MusicSearch] Кэш загружен, индексы готовы за {time.perf_counter() - started:.2f} с")
+
+threading.Thread(target=_background_load, daemon=True, name="music_load").start()
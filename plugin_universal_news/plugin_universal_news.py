@@ -3,6 +3,12 @@
 Универсальный плагин новостей v1.0
 • Основной источник: RSS Mail.ru
 • Дополнительно: WorldNewsAPI, локальный FreshRSS
+• Источники опрашиваются параллельно с общим лимитом времени
+• Кэш заголовков с фоновым обновлением и условными запросами (ETag / If-Modified-Since)
+• RSS разбирается потоково и дочитывается только до нужного числа заголовков
+• Похожие заголовки разных источников (перефразированная одна новость) сводятся в один
+• Помнит уже прочитанные новости и в первую очередь читает новые
+• Начинает читать, как только ответил первый источник, остальное досказывает по мере поступления
 • Все настройки — через веб-интерфейс
 
 Автор: mrSaT13
@@ -13,7 +19,17 @@ from irene.brain.abc import VAApiExt
 import requests
 import xml.etree.ElementTree as ET
 import re
+import os
+import json
+import time
+import base64
+import hashlib
+import random
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from functools import lru_cache
 
 name = "universal_news"
 version = "1.0.0"
@@ -22,6 +38,24 @@ config = {
     # --- Общие ---
     "enabled": True,
     "max_headlines": 7,
+    # Сколько заголовков брать из каждого источника: с запасом на повторы и уже прочитанные
+    "fetch_max_items": 40,
+    # Сколько часов помнить прочитанные новости (забываются через половину–целый срок)
+    "read_memory_hours": 48,
+    # Доля общих слов (0–1), начиная с которой заголовки считаются одной новостью
+    "dedup_threshold": 0.6,
+    # Сколько секунд ждать все источники вместе; опоздавшие в сводку не попадают
+    "fetch_deadline": 6,
+    # Читать сводку по мере ответа источников, а не одной фразой после всех
+    "progressive_speech": True,
+    # Кэш заголовков: сколько секунд данные источника считаются свежими
+    "mail_ru_ttl": 600,
+    "worldnewsapi_ttl": 3600,     # API с лимитом запросов — обновляем реже
+    "freshrss_ttl": 300,
+    # Старше этого (сек) кэш не зачитывается сразу — сначала пробуем скачать заново
+    "cache_max_age": 6 * 3600,
+    # Обновлять кэш в фоне, не дожидаясь команды
+    "background_refresh": True,
     "triggers": ["новости", "расскажи новости", "какие новости", "прочитай новости"],
 
     # --- Mail.ru RSS (основной, всегда включён) ---
@@ -41,6 +75,7 @@ config = {
     # --- Ответы ---
     "reply_fetching": "Сейчас подготовлю сводку новостей...",
     "reply_empty": "Свежих новостей пока нет.",
+    "reply_no_new": "Новых новостей с прошлого раза нет. Напомню последние.",
     "reply_error": "Не удалось получить новости. Проверьте настройки и интернет."
 }
 
@@ -54,6 +89,15 @@ config_comment = """
 ✅ FreshRSS — локальный сервер (требует IP, логин/пароль)
 
 НАСТРОЙКИ:
+- fetch_max_items: сколько заголовков брать из каждого источника (запас на повторы и прочитанное)
+- read_memory_hours: сколько помнить прочитанные новости; повторно они звучат, только если новых нет
+- dedup_threshold: насколько похожими (доля общих слов, 0–1) должны быть заголовки, чтобы считаться одной новостью;
+  заголовки с разными числами или именами не объединяются при любом пороге
+- fetch_deadline: общий лимит ожидания источников (сек), они опрашиваются одновременно
+- progressive_speech: начинать читать, как только ответил первый источник (иначе — одной фразой в конце)
+- mail_ru_ttl / worldnewsapi_ttl / freshrss_ttl: сколько секунд заголовки источника считаются свежими
+- cache_max_age: кэш старше этого не зачитывается без попытки обновления
+- background_refresh: обновлять заголовки в фоне (команда тогда отвечает без обращения к сети)
 - mail_ru_rss_url: URL RSS-ленты (не меняйте без необходимости)
 - worldnewsapi_enabled: включить WorldNewsAPI
 - worldnewsapi_key: ваш ключ с https://worldnewsapi.com  
@@ -66,28 +110,261 @@ config_comment = """
 """
 
 
-def _fetch_mail_ru() -> list:
+# === Поиск похожих заголовков: MinHash + LSH ===
+# Заголовок → множество основ слов; MinHash-подпись оценивает долю общих слов (Jaccard),
+# LSH раскладывает подписи по корзинам, и точно сравниваются только пары из одной корзины.
+# Так группировка почти линейна по числу заголовков.
+# Общих слов мало, чтобы отличить «курс доллара опустился ниже 90 рублей» от того же про евро
+# и 100 рублей, поэтому числа и имена собственные должны не противоречить друг другу.
+_STOP_WORDS = {"для", "что", "как", "при", "или", "это", "его", "все", "уже", "над", "под", "после", "из-за"}
+_STEM_LENGTH = 5            # грубая основа: первые буквы слова, чтобы совпадали падежные формы
+_MINHASH_SIZE = 32
+_LSH_ROWS = 2               # 16 корзин по 2 хеша: пары с Jaccard ≥ 0.6 почти всегда попадают в одну корзину
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240601)
+_MINHASH_PARAMS = [(_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(_MINHASH_PRIME))
+                   for _ in range(_MINHASH_SIZE)]
+
+
+def _shingles(title: str) -> frozenset:
+    words = re.findall(r"\w+", title.lower().replace("ё", "е"))
+    return frozenset(w if w.isdigit() else w[:_STEM_LENGTH] for w in words
+                     if (len(w) > 2 or w.isdigit()) and w not in _STOP_WORDS)
+
+
+def _marks(title: str) -> frozenset:
+    """
+    Отличительные слова заголовка: числа и основы имён собственных (с заглавной буквы
+    не в начале). Если с заглавной почти всё (Title Case, КАПС), имена не выделяются.
+    """
+    words = re.findall(r"\w+", title.replace("ё", "е").replace("Ё", "Е"))
+    numbers = {w for w in words if w.isdigit()}
+    names = [w for w in words[1:] if w[0].isupper() and not w.isdigit()]
+    if len(names) * 2 > len(words):
+        names = []
+    return frozenset(numbers.union(w.lower()[:_STEM_LENGTH] for w in names if len(w) > 2 or w.isupper()))
+
+
+@lru_cache(maxsize=16384)
+def _shingle_hashes(shingle: str) -> tuple:
+    h = zlib.crc32(shingle.encode("utf-8"))
+    return tuple((a * h + b) % _MINHASH_PRIME for a, b in _MINHASH_PARAMS)
+
+
+def _minhash(shingles: frozenset) -> tuple:
+    return tuple(map(min, zip(*map(_shingle_hashes, shingles))))
+
+
+def _cluster_headlines(titles: list) -> list:
+    """
+    Группы похожих заголовков. Первый в группе — заголовок, встретившийся раньше всех
+    (источники идут по приоритету); группы упорядочены по своему первому заголовку.
+    Заголовок сравнивается только с первыми заголовками групп, поэтому цепочка
+    «A похож на B, B похож на C» не склеивает непохожие A и C.
+    """
+    threshold = float(config.get("dedup_threshold", 0.6))
+    clusters = []
+    features = []        # (основы, отличительные слова) первого заголовка каждой группы
+    buckets = {}         # ключ LSH → номера групп, в корзине только первые заголовки
+    for title in titles:
+        shingles = _shingles(title)
+        marks = _marks(title)
+        # Заголовок из одних служебных слов сравниваем целиком
+        keys = [("text", title.strip().lower())]
+        if shingles:
+            signature = _minhash(shingles)
+            keys = [(band, signature[band:band + _LSH_ROWS]) for band in range(0, _MINHASH_SIZE, _LSH_ROWS)]
+
+        best, best_score = None, threshold
+        seen = set()
+        for key in keys:
+            for c in buckets.get(key, ()):
+                if c in seen:
+                    continue
+                seen.add(c)
+                if not shingles:
+                    best = c
+                    break
+                rep_shingles, rep_marks = features[c]
+                score = len(shingles & rep_shingles) / len(shingles | rep_shingles)
+                # У каждого есть число или имя, которого нет у другого, — это разные новости
+                if score < threshold or (marks - rep_shingles and rep_marks - shingles):
+                    continue
+                # Самая похожая группа; при равенстве — более ранняя
+                if best is None or score > best_score or (score == best_score and c < best):
+                    best, best_score = c, score
+        if best is not None:
+            clusters[best].append(title)
+            continue
+        clusters.append([title])
+        features.append((shingles, marks))
+        for key in keys:
+            buckets.setdefault(key, []).append(len(clusters) - 1)
+    return clusters
+
+
+def _dedup_headlines(titles: list) -> list:
+    """По одному заголовку из каждой группы похожих, порядок сохраняется."""
+    return [cluster[0] for cluster in _cluster_headlines(titles)]
+
+
+# === Память о прочитанных новостях ===
+# Два фильтра Блума фиксированного размера: текущий и предыдущий. Раз в полсрока read_memory_hours
+# текущий становится предыдущим, а самый старый забывается — файл не растёт, сколько бы ни читали.
+_read_file = "news_read.json"
+_BLOOM_BITS = 1 << 16        # 8 КБ на поколение; при тысяче заголовков ложных срабатываний ~1e-5
+_BLOOM_HASHES = 4
+_read_lock = threading.Lock()
+_read_memory = {"rotated_at": 0.0, "current": bytearray(_BLOOM_BITS // 8), "previous": bytearray(_BLOOM_BITS // 8)}
+
+
+def _headline_key(title: str) -> int:
+    """64-битный хеш нормализованного заголовка: основы слов без учёта порядка, регистра и знаков."""
+    normalized = " ".join(sorted(_shingles(title))) or title.strip().lower()
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _bloom_positions(key: int) -> list:
+    h1, h2 = key >> 32, (key & 0xFFFFFFFF) | 1
+    return [(h1 + i * h2) % _BLOOM_BITS for i in range(_BLOOM_HASHES)]
+
+
+def _rotate_read_memory(now: float):
+    half = float(config.get("read_memory_hours", 48)) * 3600 / 2
+    age = now - _read_memory["rotated_at"]
+    if age < half:
+        return
+    if age < 2 * half:
+        _read_memory["previous"] = _read_memory["current"]
+    else:
+        _read_memory["previous"] = bytearray(_BLOOM_BITS // 8)
+    _read_memory["current"] = bytearray(_BLOOM_BITS // 8)
+    _read_memory["rotated_at"] = now
+
+
+def _is_read(title: str) -> bool:
+    positions = _bloom_positions(_headline_key(title))
+    with _read_lock:
+        _rotate_read_memory(time.time())
+        return any(all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+                   for bits in (_read_memory["current"], _read_memory["previous"]))
+
+
+def _mark_read(titles: list):
+    with _read_lock:
+        _rotate_read_memory(time.time())
+        bits = _read_memory["current"]
+        for title in titles:
+            for p in _bloom_positions(_headline_key(title)):
+                bits[p >> 3] |= 1 << (p & 7)
+        data = {
+            "rotated_at": _read_memory["rotated_at"],
+            "current": base64.b64encode(bytes(_read_memory["current"])).decode("ascii"),
+            "previous": base64.b64encode(bytes(_read_memory["previous"])).decode("ascii"),
+        }
+    try:
+        tmp = _read_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, _read_file)
+    except OSError as e:
+        print(f"[News] Ошибка сохранения прочитанных новостей: {e}")
+
+
+def _load_read_memory():
+    try:
+        with open(_read_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        current = bytearray(base64.b64decode(data["current"]))
+        previous = bytearray(base64.b64decode(data["previous"]))
+        if len(current) == len(previous) == _BLOOM_BITS // 8:
+            _read_memory.update(rotated_at=float(data["rotated_at"]), current=current, previous=previous)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[News] Ошибка чтения прочитанных новостей: {e}")
+
+
+def _unread_clusters(titles: list) -> list:
+    """Группы похожих заголовков, ни один из которых ещё не звучал."""
+    return [cluster for cluster in _cluster_headlines(titles) if not any(map(_is_read, cluster))]
+
+
+# Ответ 304: заголовки не изменились, разбирать нечего
+_NOT_MODIFIED = object()
+
+
+def _conditional_headers(validators: dict) -> dict:
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def _remember_validators(validators: dict, resp):
+    validators.clear()
+    if resp.headers.get("ETag"):
+        validators["etag"] = resp.headers["ETag"]
+    if resp.headers.get("Last-Modified"):
+        validators["last_modified"] = resp.headers["Last-Modified"]
+
+
+def _parse_rss_titles(stream, limit: int) -> list:
+    """
+    Заголовки <item> из RSS по мере чтения потока. Разобранные элементы сразу удаляются
+    из дерева, поэтому память не растёт с размером ленты; после limit заголовков чтение прекращается.
+    """
+    headlines = []
+    parents = []
+    try:
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag != "item":
+                continue
+            text = (elem.findtext("title") or "").strip()
+            if text and len(text) > 15:
+                headlines.append(text)
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+            if len(headlines) >= limit:
+                break
+    except ET.ParseError as e:
+        # Лента оборвалась или битая — отдаём то, что успели разобрать
+        if not headlines:
+            raise
+        print(f"[News] RSS разобран частично: {e}")
+    return headlines
+
+
+# Источники возвращают список заголовков, _NOT_MODIFIED на 304 или None при ошибке.
+# validators — ETag/Last-Modified прошлого ответа; при новом ответе обновляются на месте.
+def _fetch_mail_ru(validators: dict) -> list:
     """Получает заголовки из RSS Mail.ru."""
     try:
-        resp = requests.get(config["mail_ru_rss_url"], timeout=8)
-        if resp.status_code != 200:
-            return []
-        root = ET.fromstring(resp.content)
-        headlines = []
-        for item in root.findall(".//item"):
-            title = item.find("title")
-            if title is not None and title.text:
-                text = title.text.strip()
-                if text and len(text) > 15:
-                    headlines.append(text)
-        return headlines
+        with requests.get(config["mail_ru_rss_url"], headers=_conditional_headers(validators),
+                          timeout=8, stream=True) as resp:
+            if resp.status_code == 304:
+                return _NOT_MODIFIED
+            if resp.status_code != 200:
+                return None
+            _remember_validators(validators, resp)
+            # Читаем прямо из сокета; gzip распаковывается на лету
+            resp.raw.decode_content = True
+            # С запасом: часть заголовков уйдёт как похожие или уже прочитанные
+            return _parse_rss_titles(resp.raw, int(config.get("fetch_max_items", 40)))
     except Exception as e:
         print(f"[News] Mail.ru RSS error: {e}")
-        return []
+        return None
 
 
-def _fetch_worldnews() -> list:
-    """Получает новости из WorldNewsAPI."""
+def _fetch_worldnews(validators: dict) -> list:
+    """Получает новости из WorldNewsAPI (условные запросы API не поддерживает)."""
     if not config["worldnewsapi_enabled"] or not config["worldnewsapi_key"]:
         return []
     try:
@@ -96,34 +373,27 @@ def _fetch_worldnews() -> list:
             "source-country": "ru",
             "language": "ru",
             "api-key": config["worldnewsapi_key"],
-            "number": config["max_headlines"] * 2
+            "number": int(config.get("fetch_max_items", 40))
         }
         resp = requests.get(config["worldnewsapi_url"], headers=headers, params=params, timeout=10)
         if resp.status_code != 200:
-            return []
+            return None
         data = resp.json()
-        seen = set()
-        headlines = []
+        titles = []
         for group in data.get("top_news", []):
             if not group.get("news"):
                 continue
             title = group["news"][0].get("title", "").strip()
             if not title:
                 continue
-            clean_title = re.sub(r'\s*\(\d+\s+sources?\)$', '', title)
-            key = clean_title[:30].lower()
-            if key not in seen:
-                seen.add(key)
-                headlines.append(clean_title)
-                if len(headlines) >= config["max_headlines"]:
-                    break
-        return headlines
+            titles.append(re.sub(r'\s*\(\d+\s+sources?\)$', '', title))
+        return _dedup_headlines(titles)
     except Exception as e:
         print(f"[News] WorldNewsAPI error: {e}")
-        return []
+        return None
 
 
-def _fetch_freshrss() -> list:
+def _fetch_freshrss(validators: dict) -> list:
     """Получает новости из локального FreshRSS (GReader API)."""
     if not config["freshrss_enabled"] or not config["freshrss_api_url"]:
         return []
@@ -133,86 +403,328 @@ def _fetch_freshrss() -> list:
             auth = (config["freshrss_username"], config["freshrss_password"])
         params = {
             "output": "json",
-            "n": config["max_headlines"]
+            "n": int(config.get("fetch_max_items", 40))
         }
         resp = requests.get(
             config["freshrss_api_url"],
             params=params,
             auth=auth,
+            headers=_conditional_headers(validators),
             timeout=8
         )
+        if resp.status_code == 304:
+            return _NOT_MODIFIED
         if resp.status_code != 200:
-            return []
+            return None
+        _remember_validators(validators, resp)
         data = resp.json()
         headlines = []
         for item in data.get("items", []):
             title = item.get("title", "").strip()
             if title and len(title) > 15:
                 headlines.append(title)
-                if len(headlines) >= config["max_headlines"]:
+                if len(headlines) >= int(config.get("fetch_max_items", 40)):
                     break
         return headlines
     except Exception as e:
         print(f"[News] FreshRSS error: {e}")
-        return []
+        return None
 
 
-def read_news(va: VAApiExt, text: str):
-    if not config.get("enabled", True):
-        return
+# Потоки переживают вызов: источник, не уложившийся в лимит, дорабатывает в фоне до своего таймаута
+_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="news")
 
-    va.say(config["reply_fetching"])
 
-    all_headlines = []
+# Источник: (функция, ключ TTL в config)
+_SOURCES = {
+    "Mail.ru": (_fetch_mail_ru, "mail_ru_ttl"),
+    "WorldNewsAPI": (_fetch_worldnews, "worldnewsapi_ttl"),
+    "FreshRSS": (_fetch_freshrss, "freshrss_ttl"),
+}
 
-    # Сначала основной источник
-    all_headlines.extend(_fetch_mail_ru())
 
-    # Затем опциональные
+def _enabled_sources() -> list:
+    """Имена включённых источников в порядке приоритета."""
+    sources = ["Mail.ru"]
     if config["worldnewsapi_enabled"]:
-        all_headlines.extend(_fetch_worldnews())
+        sources.append("WorldNewsAPI")
     if config["freshrss_enabled"]:
-        all_headlines.extend(_fetch_freshrss())
-
-    # Убираем дубли по первым 30 символам
-    seen = set()
-    unique_headlines = []
-    for title in all_headlines:
-        key = title[:30].lower()
-        if key not in seen:
-            seen.add(key)
-            unique_headlines.append(title)
-            if len(unique_headlines) >= config["max_headlines"]:
-                break
+        sources.append("FreshRSS")
+    return sources
 
-    if not unique_headlines:
-        va.say(config["reply_empty"])
-        return
 
-    # Формируем дату
+# === Кэш заголовков ===
+# источник → {"headlines": [...], "fetched_at": время, "etag": ..., "last_modified": ...}
+_cache_file = "news_cache.json"
+_REFRESH_TICK = 30
+_headline_cache = {}
+_cache_lock = threading.Lock()
+_inflight = {}   # источник → Future текущего обновления
+
+
+def _load_headline_cache():
+    try:
+        with open(_cache_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for source, entry in data.items():
+            if source in _SOURCES and isinstance(entry.get("headlines"), list):
+                _headline_cache[source] = entry
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[News] Ошибка чтения кэша новостей: {e}")
+
+
+def _save_headline_cache():
+    with _cache_lock:
+        data = json.dumps(_headline_cache, ensure_ascii=False)
+    try:
+        tmp = _cache_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, _cache_file)
+    except OSError as e:
+        print(f"[News] Ошибка сохранения кэша новостей: {e}")
+
+
+def _refresh_source(source: str) -> list:
+    """Скачивает источник и обновляет кэш. При ошибке остаются прежние заголовки."""
+    fetch, _ = _SOURCES[source]
+    with _cache_lock:
+        entry = dict(_headline_cache.get(source) or {})
+    validators = {key: entry[key] for key in ("etag", "last_modified") if entry.get(key)}
+
+    started = time.monotonic()
+    result = fetch(validators)
+    elapsed = time.monotonic() - started
+    if result is None:
+        print(f"[News] {source}: ошибка за {elapsed:.2f} с, остаются заголовки из кэша")
+        return entry.get("headlines", [])
+    if result is _NOT_MODIFIED:
+        print(f"[News] {source}: не изменилось (304) за {elapsed:.2f} с")
+        entry["fetched_at"] = time.time()
+    else:
+        print(f"[News] {source}: {len(result)} заголовков за {elapsed:.2f} с")
+        entry = dict(validators, headlines=result, fetched_at=time.time())
+    with _cache_lock:
+        _headline_cache[source] = entry
+    _save_headline_cache()
+    return entry["headlines"]
+
+
+def _forget_inflight(source: str, future: Future):
+    with _cache_lock:
+        if _inflight.get(source) is future:
+            del _inflight[source]
+
+
+def _submit_refresh(source: str) -> Future:
+    """Запускает обновление источника; если оно уже идёт — возвращает его же."""
+    with _cache_lock:
+        future = _inflight.get(source)
+        if future is not None:
+            return future
+        future = _executor.submit(_refresh_source, source)
+        _inflight[source] = future
+    # Вне блокировки: у уже завершённого Future колбэк выполнится сразу в этом потоке
+    future.add_done_callback(lambda done, source=source: _forget_inflight(source, done))
+    return future
+
+
+def _cached_or_refresh(source: str) -> Future:
+    """
+    Заголовки источника для сводки. Свежий кэш отдаётся сразу; устаревший — тоже сразу,
+    но источник обновляется в фоне; слишком старый или отсутствующий — скачивается.
+    """
+    with _cache_lock:
+        entry = _headline_cache.get(source)
+    age = time.time() - entry["fetched_at"] if entry else None
+    if entry is None or age > float(config.get("cache_max_age", 6 * 3600)):
+        return _submit_refresh(source)
+    if age >= float(config.get(_SOURCES[source][1], 600)):
+        _submit_refresh(source)
+    print(f"[News] {source}: из кэша, возраст {age:.0f} с")
+    future = Future()
+    future.set_result(entry["headlines"])
+    return future
+
+
+def _refresh_loop():
+    """Фоновое обновление: к приходу команды кэш обычно уже свежий."""
+    # Небольшая пауза после импорта: Ирина успеет применить настройки из веб-интерфейса
+    time.sleep(5)
+    while True:
+        if config.get("enabled", True) and config.get("background_refresh", True):
+            now = time.time()
+            for source in _enabled_sources():
+                with _cache_lock:
+                    entry = _headline_cache.get(source)
+                if entry is None or now - entry["fetched_at"] >= float(config.get(_SOURCES[source][1], 600)):
+                    _submit_refresh(source)
+        time.sleep(_REFRESH_TICK)
+
+
+def _enough_from_prefix(futures: list) -> bool:
+    """
+    Набрали ли уже ответившие источники, идущие подряд с начала списка, max_headlines
+    разных непрочитанных новостей. Тогда более медленные источники сводку не изменят — их можно не ждать.
+    """
+    titles = []
+    for _, future in futures:
+        if not future.done():
+            return False
+        titles.extend(future.result())
+        if len(_unread_clusters(titles)) >= config["max_headlines"]:
+            return True
+    return False
+
+
+def _fetch_all() -> list:
+    """Опрашивает источники одновременно; возвращает то, что пришло до fetch_deadline."""
+    deadline = float(config.get("fetch_deadline", 6))
+    started = time.monotonic()
+    futures = [(source, _cached_or_refresh(source)) for source in _enabled_sources()]
+    pending = {future for _, future in futures if not future.done()}
+    while pending and not _enough_from_prefix(futures):
+        left = deadline - (time.monotonic() - started)
+        if left <= 0:
+            break
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+
+    headlines = []
+    for source, future in futures:
+        if future.done():
+            headlines.extend(future.result())
+        elif _enough_from_prefix(futures):
+            break
+        else:
+            print(f"[News] {source}: не уложился в {deadline:g} с, сводка без него")
+    print(f"[News] Источники опрошены за {time.monotonic() - started:.2f} с")
+    return headlines
+
+
+# Живые вводные фразы
+_INTRO_PHRASES = [
+    "Слушайте первую новость: {}.",
+    "А вот что ещё произошло: {}.",
+    "Также стало известно, что {}.",
+    "Между тем, {}.",
+    "Ещё одна важная новость: {}.",
+    "На международной арене: {}.",
+    "Интересное событие: {}."
+]
+_MONTH_NAMES = ["", "января", "февраля", "марта", "апреля", "мая", "июня",
+                "июля", "августа", "сентября", "октября", "ноября", "декабря"]
+_CLOSING = "Вот такие новости на сегодня. Спасибо, что остаётесь с нами!"
+
+
+def _greeting() -> str:
     now = datetime.now()
-    month_names = ["", "января", "февраля", "марта", "апреля", "мая", "июня",
-                   "июля", "августа", "сентября", "октября", "ноября", "декабря"]
-    date_str = f"{now.day} {month_names[now.month]}"
-
-    # Живые вводные фразы
-    intro_phrases = [
-        "Слушайте первую новость: {}.",
-        "А вот что ещё произошло: {}.",
-        "Также стало известно, что {}.",
-        "Между тем, {}.",
-        "Ещё одна важная новость: {}.",
-        "На международной арене: {}.",
-        "Интересное событие: {}."
-    ]
-
-    parts = [f"Добрый день! Сводка новостей на {date_str}."]
-    for i, title in enumerate(unique_headlines):
-        phrase = intro_phrases[i % len(intro_phrases)]
-        parts.append(phrase.format(title))
-    parts.append("Вот такие новости на сегодня. Спасибо, что остаётесь с нами!")
+    return f"Добрый день! Сводка новостей на {now.day} {_MONTH_NAMES[now.month]}."
 
+
+def _headline_phrase(i: int, title: str) -> str:
+    return _INTRO_PHRASES[i % len(_INTRO_PHRASES)].format(title)
+
+
+def _say_digest(va: VAApiExt, clusters: list):
+    parts = [_greeting()]
+    for i, cluster in enumerate(clusters):
+        parts.append(_headline_phrase(i, cluster[0]))
+    parts.append(_CLOSING)
     va.say(" ".join(parts))
 
 
+def _choose_clusters(va: VAApiExt, titles: list) -> list:
+    """Непрочитанные группы; если новых нет — говорит об этом и отдаёт последние."""
+    chosen = _unread_clusters(titles)[:config["max_headlines"]]
+    if not chosen:
+        va.say(config["reply_no_new"])
+        chosen = _cluster_headlines(titles)[:config["max_headlines"]]
+    # Прочитанной считается вся группа — перефразированная копия в другой раз тоже не прозвучит
+    _mark_read([title for cluster in chosen for title in cluster])
+    return chosen
+
+
+def _read_news_at_once(va: VAApiExt):
+    va.say(config["reply_fetching"])
+
+    # Порядок в списке — по приоритету источников, а не по скорости ответа
+    all_headlines = _fetch_all()
+    if not all_headlines:
+        va.say(config["reply_empty"])
+        return
+    # Одна и та же новость из разных источников звучит один раз; прочитанные — только если новых нет
+    _say_digest(va, _choose_clusters(va, all_headlines))
+
+
+def _read_news_progressive(va: VAApiExt):
+    """
+    Читает сводку по мере ответа источников: приветствие и первая новость звучат, как только
+    пришёл первый источник. Группы похожих заголовков пересчитываются по всему полученному,
+    поэтому копия уже прозвучавшей новости из более медленного источника пропускается.
+    """
+    deadline = float(config.get("fetch_deadline", 6))
+    started = time.monotonic()
+    futures = [(source, _cached_or_refresh(source)) for source in _enabled_sources()]
+    if not any(future.done() for _, future in futures):
+        va.say(config["reply_fetching"])
+
+    received = []
+    handled = set()
+    spoken = set()       # заголовки групп, которые уже прозвучали (вместе с их копиями)
+    count = 0
+    while count < config["max_headlines"]:
+        arrived = [future for _, future in futures if future.done() and future not in handled]
+        for future in arrived:
+            handled.add(future)
+            received.extend(future.result())
+        if arrived:
+            for cluster in _cluster_headlines(received):
+                if count >= config["max_headlines"]:
+                    break
+                if spoken.intersection(cluster):
+                    spoken.update(cluster)
+                    continue
+                if any(map(_is_read, cluster)):
+                    continue
+                phrase = _headline_phrase(count, cluster[0])
+                va.say(f"{_greeting()} {phrase}" if count == 0 else phrase)
+                spoken.update(cluster)
+                count += 1
+        pending = [future for _, future in futures if future not in handled]
+        left = deadline - (time.monotonic() - started)
+        if not pending or left <= 0:
+            break
+        wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+
+    for source, future in futures:
+        if future not in handled and count < config["max_headlines"]:
+            print(f"[News] {source}: не уложился в {deadline:g} с, сводка без него")
+    print(f"[News] Сводка прочитана за {time.monotonic() - started:.2f} с")
+
+    if count:
+        _mark_read(list(spoken))
+        va.say(_CLOSING)
+        return
+    if not received:
+        va.say(config["reply_empty"])
+        return
+    # Всё полученное уже звучало раньше
+    _say_digest(va, _choose_clusters(va, received))
+
+
+def read_news(va: VAApiExt, text: str):
+    if not config.get("enabled", True):
+        return
+    if config.get("progressive_speech", True):
+        _read_news_progressive(va)
+    else:
+        _read_news_at_once(va)
+
+
 define_commands = {trigger: read_news for trigger in config["triggers"]}
+
+_load_headline_cache()
+_load_read_memory()
+threading.Thread(target=_refresh_loop, daemon=True, name="news_refresh").start()
@@ -2,6 +2,10 @@
 Универсальный плагин погоды для Irene Voice Assistant
 Поддерживает OpenWeather, Yandex (неофициальный) и wttr.in
 Автоматически переключается между источниками при ошибках или лимитах
+Кэширует ответы по городу и источнику: свежие отдаются сразу, устаревшие — сразу с фоновым обновлением
+Источники опрашиваются наперегонки: запасные стартуют с небольшой задержкой, побеждает первый ответ
+Следит за здоровьем источников: быстрые и надёжные идут первыми, сломанные временно отключаются
+Координаты города для Yandex берутся из офлайн-справочника cities.tsv (рядом с плагином)
 Все настройки — через веб-интерфейс
 Автор: mrSaT13
 Версия: 1.1.0
@@ -12,6 +16,11 @@ import requests
 import time
 import json
 import os
+import threading
+import queue
+import atexit
+import re
+import unicodedata
 
 # ==================== МЕТАИНФОРМАЦИЯ ====================
 name = "weather_universal"
@@ -26,7 +35,7 @@ config = {
     # --- Yandex (неофициальный) ---
     "yandex_enabled": False,
     "yandex_api_key": "",
-    # Лимит 40/день — отслеживается автоматически через файл
+    # Лимит 40/день — считается в памяти, в файл сохраняется в фоне
     "yandex_quota_file": "yandex_quota.json",
 
     # --- wttr.in (без API) ---
@@ -35,7 +44,19 @@ config = {
 
     # --- Общие ---
     "city": "Moscow",
+    "coords": "",                # "широта,долгота" — если города нет в справочнике cities.tsv
     "auto_fallback": True,
+    "race_sources": True,        # опрашивать источники наперегонки, а не строго по очереди
+    "hedge_delay": 1.5,          # сек: через сколько стартует следующий источник, если предыдущий молчит
+    "adaptive_order": True,      # ставить вперёд источники, которые отвечают быстрее и реже ошибаются
+    "breaker_failures": 3,       # после стольких ошибок подряд источник временно отключается
+    "breaker_backoff": 30,       # сек: первая пауза перед пробным запросом, дальше удваивается
+    "breaker_backoff_max": 1800, # сек: максимальная пауза
+
+    # --- Кэш ---
+    "cache_ttl": 600,            # сек: ответ считается свежим, сеть не нужна
+    "cache_stale": 6 * 3600,     # сек: устаревший ответ ещё звучит сразу, а в фоне обновляется
+    "weather_cache_file": "weather_cache.json",
 
     # --- Триггеры ---
     "triggers": [
@@ -64,13 +85,27 @@ config_comment = """
 
 НАСТРОЙКИ:
 - city: город на английском (Moscow, Berlin, Tokyo и т.д.)
+- coords: "широта,долгота" для Yandex, если города нет в справочнике cities.tsv (обычно не нужно)
 - auto_fallback: пробовать следующий источник при ошибке
+- race_sources: гонка источников — первый источник стартует сразу, следующий через hedge_delay
+  (или сразу, если предыдущие уже ответили ошибкой); звучит первый удачный ответ, остальные не запускаются
+- hedge_delay: задержка в секундах перед запуском следующего источника
+
+ЗДОРОВЬЕ ИСТОЧНИКОВ:
+- adaptive_order: порядок источников по скользящей задержке и доле ошибок (новые — по порядку настроек; Yandex с квотой — после безлимитных)
+- breaker_failures: после стольких ошибок подряд (таймаут, 429, 403...) источник отключается
+- breaker_backoff / breaker_backoff_max: пауза до пробного запроса; после неудачной пробы удваивается
 - triggers: список голосовых команд для вызова погоды
 - Все источники можно включать/выключать
 
+КЭШ:
+- cache_ttl: сколько секунд ответ считается свежим (запроса в сеть нет)
+- cache_stale: до какого возраста устаревший ответ звучит сразу, пока в фоне идёт обновление
+- weather_cache_file: последние удачные ответы по городу и источнику (в папке данных Ирины)
+
 КВОТА YANDEX:
-Используется файл yandex_quota.json для отслеживания лимита (40/день).
-Файл сохраняется в папке данных Ирины (~/irene/).
+Лимит 40/день считается в памяти (безопасно при одновременных запросах) и сбрасывается в полночь UTC.
+Счётчик сохраняется в yandex_quota.json в папке данных Ирины (~/irene/) из фонового потока.
 
 ВНИМАНИЕ:
 Yandex API неофициальный
@@ -79,36 +114,191 @@ Yandex API неофициальный
 
 # ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
 
-def _load_yandex_quota():
-    path = os.path.join(os.environ.get("IRENE_HOME", "/irene"), config["yandex_quota_file"])
-    try:
-        if os.path.exists(path):
+def _next_day_start(now):
+    return now - (now % 86400) + 86400
+
+
+class _DailyQuota:
+    """
+    Суточная квота как ведро жетонов: в полночь UTC в нём limit жетонов,
+    каждый запрос забирает один. Счётчик живёт в памяти под замком, поэтому
+    одновременные запросы не теряют приращений и не превышают лимит, а на пути
+    запроса нет записи файла. На диск состояние уходит из фонового
+    потока пачкой (временный файл + переименование); формат файла прежний.
+    Читается файл один раз, при первом обращении, а не при импорте: путь зависит от настроек,
+    которые Ирина применяет уже после загрузки плагина. Сменился путь — файл читается заново.
+    """
+
+    def __init__(self, limit, file_key, flush_delay=2.0):
+        self.limit = limit
+        self.file_key = file_key
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._used = 0
+        self._reset = _next_day_start(int(time.time()))
+        self._dirty = threading.Event()
+        self._writer = None
+        self._loaded_path = None   # файл, из которого прочитано состояние
+        self._load_lock = threading.Lock()
+
+    def _path(self):
+        return os.path.join(os.environ.get("IRENE_HOME", "/irene"), config[self.file_key])
+
+    def _roll(self, now):
+        # Под замком: новые сутки — ведро снова полное
+        if now >= self._reset:
+            self._used = 0
+            self._reset = _next_day_start(now)
+
+    def _ensure_loaded(self):
+        # Пока файл читается, жетоны не выдаются — иначе чтение затёрло бы их счёт
+        if self._path() != self._loaded_path:
+            with self._load_lock:
+                if self._path() != self._loaded_path:
+                    self.load()
+
+    def acquire(self):
+        """Берёт жетон. Возвращает метку суток (для refund) или None, если лимит исчерпан."""
+        self._ensure_loaded()
+        with self._lock:
+            self._roll(int(time.time()))
+            if self._used >= self.limit:
+                return None
+            self._used += 1
+            day = self._reset
+        self._schedule_flush()
+        return day
+
+    def refund(self, day):
+        """Возвращает жетон запроса, который до сервиса не дошёл (только в те же сутки)."""
+        with self._lock:
+            if day != self._reset or self._used <= 0:
+                return
+            self._used -= 1
+        self._schedule_flush()
+
+    def exhaust(self):
+        """Сервис сам сказал, что лимит кончился (403/429) — до конца суток не спрашиваем."""
+        self._ensure_loaded()
+        with self._lock:
+            self._roll(int(time.time()))
+            self._used = self.limit
+        self._schedule_flush()
+
+    def load(self):
+        path = self._path()
+        try:
             with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
-                now = int(time.time())
-                day_start = now - (now % 86400)
-                if data.get("reset", 0) >= day_start:
-                    return data.get("used", 0), data["reset"]
-        return 0, int(time.time()) - (int(time.time()) % 86400) + 86400
-    except Exception as e:
-        print(f"[Weather] Ошибка загрузки квоты Yandex: {e}")
-        return 0, int(time.time()) + 86400
-
-
-def _save_yandex_quota(used, reset):
-    path = os.path.join(os.environ.get("IRENE_HOME", "/irene"), config["yandex_quota_file"])
+        except FileNotFoundError:
+            data = {}
+        except Exception as e:
+            print(f"[Weather] Ошибка загрузки квоты Yandex: {e}")
+            data = {}
+        with self._lock:
+            if int(data.get("reset", 0)) > int(time.time()):
+                self._used = min(int(data.get("used", 0)), self.limit)
+                self._reset = int(data["reset"])
+        self._loaded_path = path
+
+    def flush(self):
+        if self._loaded_path is None:
+            # Квоту не трогали — не затираем файл пустым счётчиком
+            return
+        with self._lock:
+            data = {"used": self._used, "reset": self._reset}
+        path = self._path()
+        try:
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[Weather] Ошибка сохранения квоты Yandex: {e}")
+
+    def _schedule_flush(self):
+        self._dirty.set()
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, daemon=True,
+                                                    name="weather_quota")
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            self._dirty.wait()
+            # Копим изменения, чтобы серия запросов дала одну запись
+            time.sleep(self.flush_delay)
+            self._dirty.clear()
+            self.flush()
+
+
+_yandex_quota = _DailyQuota(40, "yandex_quota_file")
+
+
+# ==================== СПРАВОЧНИК ГОРОДОВ ====================
+# Источникам, которые принимают только координаты (Yandex), город переводится
+# в широту и долготу локально: без онлайн-геокодинга, квоты и сети.
+_CITIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.tsv")
+_city_index = None   # нормализованное название → (широта, долгота); грузится при первом обращении
+_city_index_lock = threading.Lock()
+
+
+def _normalize_city(city):
+    """«г. Санкт-Петербург», «St. Petersburg» → «санкт петербург», «st petersburg»; ё → е, без диакритики."""
+    city = unicodedata.normalize("NFKD", city.lower())
+    city = "".join(ch for ch in city if not unicodedata.combining(ch))
+    city = re.sub(r"[\s\-‐–—_.,'’]+", " ", city).strip()
+    return re.sub(r"^(г|гор|город|city of) ", "", city)
+
+
+def _load_city_index():
+    index = {}
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({"used": used, "reset": reset}, f)
+        with open(_CITIES_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                lat, lon, names = line.rstrip("\n").split("\t")
+                coords = (float(lat), float(lon))
+                for city in names.split("|"):
+                    index.setdefault(_normalize_city(city), coords)
     except Exception as e:
-        print(f"[Weather] Ошибка сохранения квоты Yandex: {e}")
+        print(f"[Weather] Ошибка загрузки справочника городов: {e}")
+    return index
+
+
+def _city_coords():
+    """Координаты config["city"]: из настройки coords или из справочника. None — город неизвестен."""
+    global _city_index
+    manual = config.get("coords", "").strip()
+    if manual:
+        try:
+            lat, lon = (float(x) for x in manual.split(","))
+            return lat, lon
+        except ValueError:
+            print(f"[Weather] Неверный формат coords: {manual!r}, нужно \"широта,долгота\"")
+    if _city_index is None:
+        with _city_index_lock:
+            if _city_index is None:
+                _city_index = _load_city_index()
+    return _city_index.get(_normalize_city(config["city"]))
 
 
 # ==================== ИСТОЧНИКИ ПОГОДЫ ====================
 
+class _SourceSkipped(Exception):
+    """Источник не запрашивался: не настроен или исчерпан лимит. Это не сбой сервиса."""
+
+
+# Источники с суточным лимитом: в адаптивном порядке всегда идут после безлимитных
+_QUOTA_SOURCES = {"Yandex"}
+
+
 def _get_owm(va: VAApiExt):
     if not config["owm_enabled"] or not config["owm_api_key"]:
-        return None
+        raise _SourceSkipped()
     try:
         r = requests.get(
             "https://api.openweathermap.org/data/2.5/weather",
@@ -127,7 +317,10 @@ def _get_owm(va: VAApiExt):
             return f"{desc}, {temp}°C"
         elif r.status_code == 429:
             print("[Weather] OpenWeather: лимит исчерпан")
+            raise _SourceSkipped()
         return None
+    except _SourceSkipped:
+        raise
     except Exception as e:
         print(f"[Weather] OpenWeather ошибка: {e}")
         return None
@@ -135,22 +328,20 @@ def _get_owm(va: VAApiExt):
 
 def _get_yandex(va: VAApiExt):
     if not config["yandex_enabled"] or not config["yandex_api_key"]:
-        return None
+        raise _SourceSkipped()
 
-    used, reset = _load_yandex_quota()
-    now = int(time.time())
-    if now >= reset:
-        used = 0
-        reset = now - (now % 86400) + 86400
+    coords = _city_coords()
+    if coords is None:
+        print(f"[Weather] Yandex: города {config['city']} нет в справочнике, укажите coords")
+        raise _SourceSkipped()
+    lat, lon = coords
 
-    if used >= 40:
+    day = _yandex_quota.acquire()
+    if day is None:
         print("[Weather] Yandex: лимит 40/день исчерпан")
-        return None
-
-    # Для упрощения — координаты Москвы (можно заменить через GeoAPI позже)
-    # В будущем можно добавить геокодинг по городу
-    lat, lon = 55.7558, 37.6176
+        raise _SourceSkipped()
 
+    answered = False
     try:
         r = requests.get(
             "https://api.weather.yandex.ru/v2/forecast",
@@ -159,15 +350,22 @@ def _get_yandex(va: VAApiExt):
             timeout=8
         )
         if r.status_code == 200:
-            _save_yandex_quota(used + 1, reset)
+            answered = True  # запрос засчитан, жетон не возвращаем
             fact = r.json()["fact"]
             # Условия на русском по умолчанию от Yandex
             return f"{fact['condition']}, {fact['temp']}°C"
         elif r.status_code == 429 or r.status_code == 403:
-            _save_yandex_quota(40, reset)  # помечаем как исчерпанный
+            _yandex_quota.exhaust()  # помечаем как исчерпанный
             print(f"[Weather] Yandex ошибка {r.status_code}")
+            raise _SourceSkipped()
+        else:
+            _yandex_quota.refund(day)
         return None
+    except _SourceSkipped:
+        raise
     except Exception as e:
+        if not answered:
+            _yandex_quota.refund(day)
         print(f"[Weather] Yandex ошибка: {e}")
         return None
 
@@ -187,6 +385,283 @@ def _get_wttr(va: VAApiExt):
         return None
 
 
+# ==================== КЭШ ПОГОДЫ ====================
+# "город|источник" → {"value": текст ответа, "fetched_at": время}
+_weather_cache = {}
+_cache_lock = threading.Lock()
+_save_lock = threading.Lock()   # файл кэша пишут и гонка, и фоновое обновление
+_refreshing = set()   # города, для которых сейчас идёт фоновое обновление
+_weather_cache_source = None   # файл, из которого прочитан кэш
+
+
+def _weather_cache_path():
+    return os.path.join(os.environ.get("IRENE_HOME", "/irene"), config["weather_cache_file"])
+
+
+def _city_key():
+    return config["city"].strip().lower()
+
+
+def _load_weather_cache():
+    """
+    Читает файл кэша при первом обращении, а не при импорте: weather_cache_file
+    Ирина применяет уже после загрузки плагина. Сменился путь — файл читается заново.
+    Ответы, полученные раньше чтения, не заменяются более старыми из файла.
+    """
+    global _weather_cache_source
+    path = _weather_cache_path()
+    if path == _weather_cache_source:
+        return
+    with _cache_lock:
+        if path == _weather_cache_source:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.items():
+                current = _weather_cache.get(key)
+                if entry.get("value") and (current is None or current["fetched_at"] < entry["fetched_at"]):
+                    _weather_cache[key] = entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[Weather] Ошибка загрузки кэша погоды: {e}")
+        _weather_cache_source = path
+
+
+def _save_weather_cache():
+    path = _weather_cache_path()
+    with _cache_lock:
+        data = json.dumps(_weather_cache, ensure_ascii=False)
+    try:
+        with _save_lock:
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, path)
+    except Exception as e:
+        print(f"[Weather] Ошибка сохранения кэша погоды: {e}")
+
+
+def _cached_weather(sources):
+    """
+    Ответ из кэша для текущего города: (текст, свежий ли) или None.
+    Свежий ответ любого источника лучше устаревшего; среди равных — по порядку источников.
+    """
+    _load_weather_cache()
+    now = time.time()
+    ttl = float(config.get("cache_ttl", 600))
+    stale = float(config.get("cache_stale", 6 * 3600))
+    with _cache_lock:
+        entries = [_weather_cache.get(f"{_city_key()}|{name_src}") for name_src, _ in sources]
+    entries = [e for e in entries if e]
+    for entry in entries:
+        if now - entry["fetched_at"] < ttl:
+            return entry["value"], True
+    for entry in entries:
+        if now - entry["fetched_at"] < stale:
+            return entry["value"], False
+    return None
+
+
+def _remember(city, name_src, result):
+    _load_weather_cache()
+    with _cache_lock:
+        _weather_cache[f"{city}|{name_src}"] = {"value": result, "fetched_at": time.time()}
+    _save_weather_cache()
+
+
+def _race_sources(sources):
+    """
+    Гонка источников с подстраховкой (hedging). Первый источник стартует сразу,
+    каждый следующий — через hedge_delay после предыдущего или сразу, как только
+    все запущенные ответили ошибкой. Побеждает первый удачный ответ; источники,
+    которые ещё не стартовали, уже не запускаются (квота Yandex не тратится зря).
+    Запросы, которые уже в полёте, прервать нельзя — они доработают в фоне
+    и просто обновят кэш своего источника.
+    """
+    city = _city_key()
+    results = queue.Queue()
+    hedge = max(0.0, float(config.get("hedge_delay", 1.5)))
+
+    def run(name_src, fetcher):
+        try:
+            result = fetcher()
+        except Exception as e:
+            print(f"[Weather] {name_src} ошибка: {e}")
+            result = None
+        if result:
+            _remember(city, name_src, result)
+        results.put(result)
+
+    started = 0
+    pending = 0
+    next_start = time.monotonic()
+    while started < len(sources) or pending:
+        now = time.monotonic()
+        if started < len(sources) and (pending == 0 or now >= next_start):
+            name_src, fetcher = sources[started]
+            threading.Thread(target=run, args=(name_src, fetcher), daemon=True,
+                             name=f"weather_{name_src}").start()
+            started += 1
+            pending += 1
+            next_start = now + hedge
+            continue
+        try:
+            result = results.get(timeout=next_start - now if started < len(sources) else None)
+        except queue.Empty:
+            continue
+        pending -= 1
+        if result:
+            return result
+    return None
+
+
+def _fetch_live(sources):
+    """Получает погоду из источников; первый удачный ответ попадает в кэш."""
+    if config.get("race_sources", True):
+        return _race_sources(sources)
+    city = _city_key()
+    for name_src, fetcher in sources:
+        result = fetcher()
+        if result:
+            _remember(city, name_src, result)
+            return result
+    return None
+
+
+def _refresh_in_background(sources):
+    city = _city_key()
+    with _cache_lock:
+        if city in _refreshing:
+            return
+        _refreshing.add(city)
+
+    def run():
+        try:
+            _fetch_live(sources)
+        finally:
+            with _cache_lock:
+                _refreshing.discard(city)
+
+    threading.Thread(target=run, daemon=True, name="weather_refresh").start()
+
+
+# ==================== ЗДОРОВЬЕ ИСТОЧНИКОВ ====================
+# источник → скользящие задержка и доля ошибок, ошибки подряд и состояние автомата отключения
+_health = {}
+_health_lock = threading.Lock()
+_HEALTH_ALPHA = 0.3      # вес нового замера в скользящем среднем
+_ERROR_PENALTY = 8.0     # сек: во сколько обходится ошибка (примерно таймаут запроса)
+_UNKNOWN_SCORE = 1.0     # сек: оценка для источника, который ещё не опрашивали
+_ERROR_HALF_LIFE = 600   # сек: за это время старые ошибки весят вдвое меньше
+
+
+def _health_entry(name_src):
+    entry = _health.get(name_src)
+    if entry is None:
+        entry = _health[name_src] = {
+            "latency": None, "error_rate": 0.0, "failures": 0,
+            "open_until": 0.0, "backoff": 0.0, "probing": False, "updated": 0.0,
+        }
+    return entry
+
+
+def _score(entry, now):
+    """
+    Ожидаемое время до ответа: чем меньше, тем раньше источник в списке.
+    Ошибки со временем забываются — иначе источник, который разок ошибся и ушёл
+    в конец списка, так и не получил бы шанса исправиться.
+    """
+    if entry["latency"] is None:
+        return _UNKNOWN_SCORE
+    fading = 0.5 ** ((now - entry["updated"]) / _ERROR_HALF_LIFE)
+    return entry["latency"] + entry["error_rate"] * fading * _ERROR_PENALTY
+
+
+def _is_blocked(entry, now):
+    return bool(entry["open_until"]) and (entry["probing"] or now < entry["open_until"])
+
+
+def _record_result(name_src, ok, elapsed):
+    now = time.monotonic()
+    with _health_lock:
+        h = _health_entry(name_src)
+        h["latency"] = elapsed if h["latency"] is None else h["latency"] + _HEALTH_ALPHA * (elapsed - h["latency"])
+        h["error_rate"] += _HEALTH_ALPHA * ((0.0 if ok else 1.0) - h["error_rate"])
+        h["updated"] = now
+        was_probing = h["probing"]
+        h["probing"] = False
+        if ok:
+            if h["open_until"]:
+                print(f"[Weather] {name_src}: снова отвечает, источник включён")
+            h["failures"] = 0
+            h["open_until"] = 0.0
+            h["backoff"] = 0.0
+            return
+        h["failures"] += 1
+        if was_probing or (h["failures"] >= int(config.get("breaker_failures", 3)) and now >= h["open_until"]):
+            base = float(config.get("breaker_backoff", 30))
+            h["backoff"] = min(h["backoff"] * 2 if h["backoff"] else base,
+                               float(config.get("breaker_backoff_max", 1800)))
+            h["open_until"] = now + h["backoff"]
+            print(f"[Weather] {name_src}: {h['failures']} ошибок подряд, отключён на {round(h['backoff'])} с")
+
+
+def _tracked(name_src, fetcher, force=False):
+    """
+    Обёртка источника: замеряет время и результат. Отключённый источник не
+    запрашивается вовсе; после паузы пропускается ровно один пробный запрос.
+    force — пробный запрос раньше срока (когда отключены все источники).
+    Пропуск (_SourceSkipped) не считается ни ошибкой, ни замером задержки.
+    """
+    def run():
+        with _health_lock:
+            h = _health_entry(name_src)
+            if h["open_until"]:
+                if h["probing"] or (time.monotonic() < h["open_until"] and not force):
+                    return None
+                h["probing"] = True
+        started = time.monotonic()
+        result = None
+        try:
+            result = fetcher()
+        except _SourceSkipped:
+            with _health_lock:
+                _health_entry(name_src)["probing"] = False
+            return None
+        except Exception:
+            _record_result(name_src, False, time.monotonic() - started)
+            raise
+        _record_result(name_src, bool(result), time.monotonic() - started)
+        return result
+    return run
+
+
+def _ordered_sources(sources):
+    """
+    Убирает отключённые источники и ставит вперёд быстрые и надёжные.
+    Источники с суточным лимитом остаются позади безлимитных, даже если отвечают быстрее:
+    иначе одна удачная гонка Yandex тратила бы его 40 запросов в день на каждую команду.
+    """
+    now = time.monotonic()
+    with _health_lock:
+        entries = {name_src: _health_entry(name_src) for name_src, _ in sources}
+        blocked = {n for n, h in entries.items() if _is_blocked(h, now)}
+        scores = {n: _score(h, now) for n, h in entries.items()}
+        # Если отключены все — пробуем тот, что должен восстановиться раньше остальных
+        waiting = sorted((h["open_until"], n) for n, h in entries.items() if not h["probing"])
+    available = [s for s in sources if s[0] not in blocked]
+    if not available:
+        if not waiting:
+            return []
+        first = waiting[0][1]
+        return [(n, _tracked(n, f, force=True)) for n, f in sources if n == first]
+    if config.get("adaptive_order", True):
+        available.sort(key=lambda s: (s[0] in _QUOTA_SOURCES, scores[s[0]]))
+    return [(n, _tracked(n, f)) for n, f in available]
+
+
 # ==================== ОСНОВНАЯ ФУНКЦИЯ ====================
 
 def get_weather(va: VAApiExt, text: str):
@@ -203,11 +678,20 @@ def get_weather(va: VAApiExt, text: str):
         va.say(config["no_source_configured"])
         return
 
-    for name_src, fetcher in sources:
-        result = fetcher()
-        if result:
-            va.say(f"Погода в {config['city']}: {result}")
-            return
+    cached = _cached_weather(sources)
+    sources = _ordered_sources(sources)
+    if cached:
+        result, fresh = cached
+        if not fresh:
+            # Отвечаем сразу, а свежие данные понадобятся в следующий раз
+            _refresh_in_background(sources)
+        va.say(f"Погода в {config['city']}: {result}")
+        return
+
+    result = _fetch_live(sources)
+    if result:
+        va.say(f"Погода в {config['city']}: {result}")
+        return
 
     # Все источники провалились
     if config["auto_fallback"]:
@@ -219,3 +703,5 @@ def get_weather(va: VAApiExt, text: str):
 # ==================== КОМАНДЫ ====================
 
 define_commands = {trigger.strip(): get_weather for trigger in config["triggers"]}
+
+atexit.register(_yandex_quota.flush)